@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+Compare simlib.atl06lib.gps2dyr against astropy.
+
+Usage: python check_gps2dyr.py [npts]
+
+Draws random GPS times over the mission-relevant range, plus every
+leap-second day, and reports the max difference (secs) and runtimes
+for the TAI and UTC scales. Decimal years near 2020 are only resolved
+to ~7 microsecs in float64 (1 ulp), so differences at that level are
+rounding. Exits with status 1 if a difference exceeds 2 ulps (~1.4e-5 s,
+one rounding on each side).
+"""
+import sys
+import time
+import numpy as np
+from astropy.time import Time
+from simlib.atl06lib import gps2dyr, LEAP_SECONDS, GPS_EPOCH_UNIX
+
+# Secs per (Julian) year, to express differences in secs
+YEAR = 365.25 * 86400
+
+
+def leap_days(step=10.0):
+    """GPS times sampled across each leap-second day."""
+    dates = np.array([d for d, n in LEAP_SECONDS], dtype='datetime64[s]')
+    offsets = np.array([n for d, n in LEAP_SECONDS])
+    t_leap = dates.astype('int64') - GPS_EPOCH_UNIX + offsets
+    return np.concatenate([np.arange(t - 86401, t - 1, step) for t in t_leap])
+
+
+def compare(time_gps, scale):
+    t0 = time.perf_counter()
+    dyr = gps2dyr(time_gps, scale=scale)
+    t1 = time.perf_counter()
+    ref = Time(time_gps, format='gps')
+    ref = ref.utc.decimalyear if scale == 'utc' else ref.decimalyear
+    t2 = time.perf_counter()
+
+    diff = np.abs(dyr - ref) * YEAR
+    tol = 2 * np.spacing(np.abs(ref)).max() * YEAR
+    ok = diff.max() <= tol
+    print(f'{scale}: max |diff| = {diff.max():.3e} s (tolerance {tol:.3e} s) '
+          f'{"ok" if ok else "FAILED"}, numpy {t1 - t0:.3f} s, astropy {t2 - t1:.3f} s')
+    return ok
+
+
+def main(npts=1000000):
+    rng = np.random.default_rng(0)
+    t_gps = np.concatenate([rng.uniform(0, 1.6e9, npts), leap_days()])
+    print('Number of timestamps:', len(t_gps))
+
+    ok = [compare(t_gps, scale) for scale in ('tai', 'utc')]
+    return 0 if all(ok) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(a) for a in sys.argv[1:]]))
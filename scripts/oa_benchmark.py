@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+Benchmark simlib.icesatapi.OAClient against the local stand-in server.
+
+Usage: python oa_benchmark.py [--workers 1 8 32] [--tracks 20] [--latency 0.05]
+                              [--error-rate 0.01] [--npoints 1000] [--url URL]
+                              [--trace-memory]
+
+Starts simlib.oaserver in a subprocess (unless --url is given) and, for
+each concurrency level, requests all six beams of `tracks` synthetic
+tracks. Reports requests/s, points/s, request latency percentiles
+(including retries) and the peak RSS of the process so far. With
+--trace-memory, the peak Python memory of each run is traced instead
+(exact per run, but tracemalloc slows the client down).
+"""
+import sys
+import time
+import resource
+import argparse
+import tracemalloc
+import subprocess
+import numpy as np
+from simlib.icesatapi import OAClient
+
+
+class TimedClient(OAClient):
+    """OAClient recording the latency of every request"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = []
+
+    def get(self, payload, url=None):
+        t0 = time.perf_counter()
+        try:
+            return super().get(payload, url)
+        finally:
+            self.latencies.append(time.perf_counter() - t0)
+
+
+def start_server(args):
+    """Run simlib.oaserver in a subprocess and return it and its URL"""
+    cmd = [sys.executable, '-m', 'simlib.oaserver', '--port', '0',
+           '--latency', str(args.latency), '--jitter', str(args.jitter),
+           '--error-rate', str(args.error_rate), '--npoints', str(args.npoints), '--seed', '0']
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    return proc, proc.stdout.readline().strip()
+
+
+def run(url, workers, para_lists, retries, trace_memory=False):
+    client = TimedClient(url, max_workers=workers, retries=retries, backoff=0.05)
+
+    if trace_memory:
+        tracemalloc.start()
+    failed = []
+    t0 = time.perf_counter()
+    npts = sum(len(df) for _, _, df in client.iter_requests(para_lists, failed=failed))
+    elapsed = time.perf_counter() - t0
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    else:
+        # ru_maxrss is in kB on Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1e3
+
+    lat = np.array(client.latencies) * 1e3
+    p50, p95, p99 = np.percentile(lat, [50, 95, 99]) if len(lat) else (np.nan,) * 3
+    print(f'{workers:>7} {len(lat) / elapsed:>9.1f} {npts / elapsed:>11.0f} '
+          f'{p50:>8.1f} {p95:>8.1f} {p99:>8.1f} {peak / 1e6:>8.1f} {len(failed):>6}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', help='API endpoint (default: start a local simlib.oaserver)')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+    parser.add_argument('--tracks', type=int, default=20)
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--npoints', type=int, default=1000)
+    parser.add_argument('--trace-memory', action='store_true')
+    args = parser.parse_args()
+
+    proc = None
+    url = args.url
+    if url is None:
+        proc, url = start_server(args)
+
+    bbox = [86.0, 27.5, 87.0, 28.5]
+    para_lists = [[str(rgt), '2019-05-01', '3', bbox] for rgt in range(1, args.tracks + 1)]
+
+    print('Endpoint:', url)
+    print(f'{"workers":>7} {"req/s":>9} {"points/s":>11} {"p50 ms":>8} {"p95 ms":>8} '
+          f'{"p99 ms":>8} {"peak MB":>8} {"failed":>6}')
+    try:
+        for workers in args.workers:
+            run(url, workers, para_lists, args.retries, args.trace_memory)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,14 @@ import simlib.atl06lib
 import simlib.icesatapi
 import simlib.config
 import simlib.utils
+import simlib.projection
+import simlib.store
+import simlib.ingest
+import simlib.index
+import simlib.cache
+import simlib.oaserver
+import simlib.download
+import simlib.cmr
 
 __all__ = [
     'reference_dem',
@@ -10,4 +18,12 @@ __all__ = [
     'icesatapi',
     'config',
     'utils',
+    'projection',
+    'store',
+    'ingest',
+    'index',
+    'cache',
+    'oaserver',
+    'download',
+    'cmr',
 ]
\ No newline at end of file
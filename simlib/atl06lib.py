@@ -1,12 +1,77 @@
+import json
+import hashlib
 from pathlib import Path
-import pyproj
-from astropy.time import Time
+from collections import namedtuple
+from functools import lru_cache, partial
 import h5py
 import numpy as np
+from simlib import projection
 
-def gps2dyr(time):
-    """Converte GPS time to decimal years."""
-    return Time(time, format='gps').decimalyear
+# Seconds from the Unix epoch (1970-01-01) to the GPS epoch (1980-01-06)
+GPS_EPOCH_UNIX = 315964800
+
+# TAI - GPS offset (secs)
+TAI_GPS = 19
+
+# Leap seconds: UTC date each GPS - UTC offset (secs) came into effect
+LEAP_SECONDS = [
+    ('1981-07-01', 1), ('1982-07-01', 2), ('1983-07-01', 3),
+    ('1985-07-01', 4), ('1988-01-01', 5), ('1990-01-01', 6),
+    ('1991-01-01', 7), ('1992-07-01', 8), ('1993-07-01', 9),
+    ('1994-07-01', 10), ('1996-01-01', 11), ('1997-07-01', 12),
+    ('1999-01-01', 13), ('2006-01-01', 14), ('2009-01-01', 15),
+    ('2012-07-01', 16), ('2015-07-01', 17), ('2017-01-01', 18),
+]
+
+
+def gps2utc(time):
+    """Convert GPS time to UTC secs since the GPS epoch (86400-sec days).
+
+    Days ending in a leap second last 86401 secs and are compressed
+    into 86400, as in the ERFA (astropy) quasi-JD representation of UTC.
+    """
+    time = np.asarray(time, dtype=np.float64)
+    dates = np.array([d for d, n in LEAP_SECONDS], dtype='datetime64[s]')
+    offsets = np.array([0] + [n for d, n in LEAP_SECONDS])
+    t_day = dates.astype('int64') - GPS_EPOCH_UNIX       # UTC date (secs)
+    t_leap = t_day + offsets[1:]                          # GPS time of date
+
+    i = np.searchsorted(t_leap, time, side='right')
+    utc = time - offsets[i]
+
+    # Time within a leap-second day
+    j = np.minimum(i, len(t_leap) - 1)
+    dt = time - (t_leap[j] - 86401)
+    in_leap = (i < len(t_leap)) & (dt >= 0)
+    utc = np.where(in_leap, t_day[j] - 86400 + dt * (86400 / 86401), utc)
+    return utc
+
+
+def _decimal_year(secs):
+    """Decimal year from secs since 1970-01-01 (86400-sec days)."""
+    whole = np.floor(secs)
+    frac = secs - whole
+    year = whole.astype('int64').astype('datetime64[s]').astype('datetime64[Y]')
+    t_start = year.astype('datetime64[s]').astype('int64')
+    t_end = (year + 1).astype('datetime64[s]').astype('int64')
+    return 1970 + year.astype('int64') + ((whole - t_start) + frac) / (t_end - t_start)
+
+
+def gps2dyr(time, scale='tai'):
+    """Converte GPS time to decimal years.
+
+    Vectorized replacement for astropy's Time(time, format='gps').decimalyear,
+    which is expressed in the TAI scale. With scale='utc' leap seconds are
+    removed first (see LEAP_SECONDS).
+    """
+    time = np.asarray(time, dtype=np.float64)
+    if scale == 'tai':
+        secs = time + TAI_GPS
+    elif scale == 'utc':
+        secs = gps2utc(time)
+    else:
+        raise ValueError(f'Scale {scale} not recognized')
+    return _decimal_year(secs + GPS_EPOCH_UNIX)[()]
 
 
 def orbit_type(time, lat, tmax=1):
@@ -45,10 +110,7 @@ def transform_coord(proj1, proj2, x, y):
         Polar Stereo AnIS (x/y): 3031
         Polar Stereo GrIS (x/y): 3413
     """
-    # Set full EPSG projection strings
-    proj1 = pyproj.Proj("+init=EPSG:"+str(proj1))
-    proj2 = pyproj.Proj("+init=EPSG:"+str(proj2))
-    return pyproj.transform(proj1, proj2, x, y)  # convert
+    return projection.transform_coord(proj1, proj2, x, y)  # convert
 
     
 def segment_diff_filter(dh_fit_dx, h_li, tol=2):
@@ -71,76 +133,370 @@ def segment_diff_filter(dh_fit_dx, h_li, tol=2):
 
     return mask
 
-def read_atl06(fname, epsg, outdir='data', bbox=None):
-    """Read one ATL06 file and output 6 reduced files. 
-    
-    Extract variables of interest and separate the ATL06 file 
-    into each beam (ground track) and ascending/descending orbits.
+# A filter stage: name, function of a dict of column slices returning the
+# mask of points to keep, columns it needs, and neighbours used on each side
+class Filter(namedtuple('Filter', ['name', 'func', 'columns', 'halo'])):
+    __slots__ = ()
+
+    def __repr__(self):
+        # Parameters rather than the function address, so the repr is
+        # stable across runs (ingest compares it to skip granules)
+        params = getattr(self.func, 'keywords', {})
+        return 'Filter({})'.format(', '.join(
+            [repr(self.name)] + ['{}={!r}'.format(k, v) for k, v in sorted(params.items())]))
+
+
+# Stages are partials of module-level functions, so they can be pickled
+# (e.g. sent to the worker processes of ingest_granules)
+def _quality_mask(d):
+    return d['q_flag'] == 0
+
+
+def _range_mask(d, column, vmax):
+    return np.abs(d[column]) < vmax
+
+
+def _bbox_mask(d, bbox):
+    lonmin, latmin, lonmax, latmax = bbox
+    return (d['lon'] >= lonmin) & (d['lon'] <= lonmax) & \
+           (d['lat'] >= latmin) & (d['lat'] <= latmax)
+
+
+def _segment_diff_mask(d, tol):
+    return segment_diff_filter(d['dh_fit_dx'], d['h_li'], tol=tol)
+
+
+def _snr_mask(d, vmax):
+    return d['snr'] < vmax
+
+
+def _dem_residual_mask(d, dem, dh_max, column):
+    x, y = transform_coord(4326, dem.epsg, d['lon'], d['lat'])
+    return np.abs(d[column] - dem.sample_xy(x, y)) < dh_max
+
+
+def quality_filter():
+    """Keep segments with a good ATL06 quality summary flag."""
+    return Filter('q_flag', partial(_quality_mask), ['q_flag'], 0)
+
+
+def range_filter(column='h_li', vmax=10e3):
+    """Keep segments with |column| < vmax."""
+    return Filter('range', partial(_range_mask, column=column, vmax=vmax), [column], 0)
+
+
+def bbox_filter(bbox):
+    """Keep segments within bbox [lonmin, latmin, lonmax, latmax]."""
+    bbox = [float(b) for b in bbox]
+    return Filter('bbox', partial(_bbox_mask, bbox=bbox), ['lon', 'lat'], 0)
+
+
+def segment_diff_stage(tol=2):
+    """Keep segments consistent with their neighbours (segment_diff_filter)."""
+    return Filter('segment_diff', partial(_segment_diff_mask, tol=tol), ['dh_fit_dx', 'h_li'], 1)
+
+
+def snr_filter(vmax=0.02):
+    """Keep segments with signal-to-noise significance < vmax."""
+    return Filter('snr', partial(_snr_mask, vmax=vmax), ['snr'], 0)
+
+
+def dem_residual_filter(dem, dh_max=50, column='h_li'):
+    """Keep segments within dh_max of a reference_dem (NaN/off-DEM removed)."""
+    func = partial(_dem_residual_mask, dem=dem, dh_max=dh_max, column=column)
+    return Filter('dem_residual', func, ['lon', 'lat', column], 0)
+
+
+def default_filters(bbox=None):
+    """Filters applied by read_atl06: quality, range, bbox and segment difference."""
+    filters = [quality_filter(), range_filter()]
+    if bbox:
+        filters.append(bbox_filter(bbox))
+    filters.append(segment_diff_stage())
+    return filters
+
+
+def apply_filters(data, filters, chunk_size=100000, stats=None):
+    """Apply filter stages to along-track columns in one chunked pass.
+
+    Stages are evaluated chunk by chunk (with `halo` neighbours for
+    stages that need them), so temporaries scale with `chunk_size`
+    rather than the track length. Returns the boolean mask of points
+    kept by all stages. If a `stats` dict is given, it is updated with
+    the number of points each stage removed (among those kept by the
+    earlier stages), plus the 'total' and 'kept' counts.
     """
+    n = len(next(iter(data.values())))
+    mask = np.ones(n, dtype=bool)
+    removed = dict.fromkeys([f.name for f in filters], 0)
 
-    # Each beam is a group
-    group = ['/gt1l', '/gt1r', '/gt2l', '/gt2r', '/gt3l', '/gt3r']
+    for i0 in range(0, n, chunk_size):
+        i1 = min(i0 + chunk_size, n)
+        keep = mask[i0:i1]
 
-    # Loop trough beams
-    for k, g in enumerate(group):
-    
-        #-----------------------------------#
-        # 1) Read in data for a single beam #
-        #-----------------------------------#
-        
-        data = {}
-    
+        for f in filters:
+            # Chunk extended by the halo (at least 2 * halo + 1 points)
+            j0, j1 = max(i0 - f.halo, 0), min(i1 + f.halo, n)
+            if f.halo and j1 - j0 < 2 * f.halo + 1:
+                j0 = max(min(j0, n - 2 * f.halo - 1), 0)
+                j1 = min(max(j1, j0 + 2 * f.halo + 1), n)
+
+            ok = f.func({k: data[k][j0:j1] for k in f.columns})[i0 - j0:i1 - j0]
+            removed[f.name] += int(np.count_nonzero(keep & ~ok))
+            keep &= ok
+
+            if not keep.any():
+                break
+
+    if stats is not None:
+        for k, v in removed.items():
+            stats[k] = stats.get(k, 0) + v
+        stats['total'] = stats.get('total', 0) + n
+        stats['kept'] = stats.get('kept', 0) + int(np.count_nonzero(mask))
+
+    return mask
+
+
+# Each beam is a group
+BEAMS = ['/gt1l', '/gt1r', '/gt2l', '/gt2r', '/gt3l', '/gt3r']
+
+# Variable to read: output name, path within 'land_ice_segments', dtype
+Variable = namedtuple('Variable', ['name', 'path', 'dtype'])
+
+# Variables of interest (include as many as you want)
+ATL06_SCHEMA = [
+    Variable('lat', 'latitude', 'f8'),
+    Variable('lon', 'longitude', 'f8'),
+    Variable('h_li', 'h_li', 'f4'),
+    Variable('s_li', 'h_li_sigma', 'f4'),
+    Variable('t_dt', 'delta_time', 'f8'),
+    Variable('q_flag', 'atl06_quality_summary', 'i1'),
+    Variable('s_fg', 'fit_statistics/signal_selection_source', 'i1'),
+    Variable('snr', 'fit_statistics/snr_significance', 'f4'),
+    Variable('h_rb', 'fit_statistics/h_robust_sprd', 'f4'),
+    Variable('dac', 'geophysical/dac', 'f4'),
+    Variable('f_sn', 'geophysical/bsnow_conf', 'i1'),
+    Variable('dh_fit_dx', 'fit_statistics/dh_fit_dx', 'f4'),
+    Variable('tide_earth', 'geophysical/tide_earth', 'f4'),
+    Variable('tide_load', 'geophysical/tide_load', 'f4'),
+    Variable('tide_ocean', 'geophysical/tide_ocean', 'f4'),
+    Variable('tide_pole', 'geophysical/tide_pole', 'f4'),
+]
+
+# Variables needed by the derived outputs of read_atl06 (filters add their own)
+REQUIRED_VARS = ['lat', 'lon', 't_dt']
+
+
+def project_schema(columns=None, schema=ATL06_SCHEMA, required=()):
+    """Select the schema entries for `columns` plus `required` names.
+
+    Returns all of `schema` if `columns` is None. Order follows the schema.
+    """
+    if columns is None:
+        return list(schema)
+    names = set(columns) | set(required)
+    unknown = names - {v.name for v in schema}
+    if unknown:
+        raise ValueError(f'Variables not in schema: {sorted(unknown)}')
+    return [v for v in schema if v.name in names]
+
+
+def _decode(value):
+    """Return HDF5 string attribute as str."""
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+def read_ancillary(fi):
+    """Read the granule-level fields shared by all beams of an open file."""
+    return {
+        'rgt': int(fi['/orbit_info/rgt'][0]),                            # single value
+        'cycle': int(fi['/orbit_info/cycle_number'][0]),                 # single value
+        't_ref': float(fi['/ancillary_data/atlas_sdp_gps_epoch'][0]),    # single value
+    }
+
+
+def bbox_slice(lat, bbox, stride=1):
+    """Index range of an along-track latitude dataset overlapping bbox.
+
+    Latitude is monotonic along track within a granule, so the range of
+    segments within [latmin, latmax] can be found by binary search on
+    `lat` (or on every `stride`-th value of it). The range is padded by
+    one segment on each side so neighbour-based filters see the same
+    values as with a full read. Falls back to the full range if `lat`
+    is not monotonic.
+    """
+    n = lat.shape[0]
+    latmin, latmax = bbox[1], bbox[3]
+    lat_s = lat[::stride]
+
+    # Descending tracks: search on the negated latitude
+    if lat_s.size > 1 and lat_s[0] > lat_s[-1]:
+        lat_s, latmin, latmax = -lat_s, -latmax, -latmin
+
+    if not np.all(np.diff(lat_s) >= 0):
+        return slice(0, n)
+
+    j0 = np.searchsorted(lat_s, latmin, side='left')
+    j1 = np.searchsorted(lat_s, latmax, side='right')
+
+    i0 = max((j0 - 1) * stride, 0)
+    i1 = min(j1 * stride + 1, n)
+
+    # Keep at least three segments (see segment_diff_filter)
+    if i1 - i0 < 3 and i1 > i0 and n >= 3:
+        i0 = min(i0, n - 3)
+        i1 = max(i1, i0 + 3)
+
+    return slice(i0, max(i0, i1))
+
+
+def read_beam(fi, g, bbox=None, lat_stride=1, schema=ATL06_SCHEMA):
+    """Read the `schema` variables for a single beam of an open file.
+
+    If `bbox` is given, only the along-track range overlapping its
+    latitude bounds is read (see bbox_slice).
+    """
+    seg = fi[g + '/land_ice_segments']
+    if bbox:
+        sl = bbox_slice(seg['latitude'], bbox, lat_stride)
+    else:
+        sl = slice(None)
+    data = {v.name: np.asarray(seg[v.path][sl], dtype=v.dtype) for v in schema}
+    attrs = {
+        'beam_type': _decode(fi[g].attrs['atlas_beam_type']),      # strong/weak (str)
+        'spot_number': _decode(fi[g].attrs['atlas_spot_number']),  # number (str)
+    }
+    return data, attrs
+
+
+def read_beams(fi, beams=BEAMS, nthreads=1, bbox=None, lat_stride=1,
+               schema=ATL06_SCHEMA):
+    """Read several beams of an open file, optionally on a thread pool.
+
+    If `bbox` is given, only the latitude range overlapping it is read.
+    Beams that are missing from the file (or fail to read) are skipped.
+    Returns a dict {beam: (data, attrs)} in the order of `beams`.
+
+    Note: h5py serializes calls into the HDF5 library, so threads mostly
+    help to overlap decompression and Python overhead between beams.
+    """
+    def read(g):
         try:
-            # Load vars into memory (include as many as you want)
-            with h5py.File(fname, 'r') as fi:
-                
-                data['lat'] = fi[g+'/land_ice_segments/latitude'][:]
-                data['lon'] = fi[g+'/land_ice_segments/longitude'][:]
-                data['h_li'] = fi[g+'/land_ice_segments/h_li'][:]
-                data['s_li'] = fi[g+'/land_ice_segments/h_li_sigma'][:]
-                data['t_dt'] = fi[g+'/land_ice_segments/delta_time'][:]
-                data['q_flag'] = fi[g+'/land_ice_segments/atl06_quality_summary'][:]
-                data['s_fg'] = fi[g+'/land_ice_segments/fit_statistics/signal_selection_source'][:]
-                data['snr'] = fi[g+'/land_ice_segments/fit_statistics/snr_significance'][:]
-                data['h_rb'] = fi[g+'/land_ice_segments/fit_statistics/h_robust_sprd'][:]
-                data['dac'] = fi[g+'/land_ice_segments/geophysical/dac'][:]
-                data['f_sn'] = fi[g+'/land_ice_segments/geophysical/bsnow_conf'][:]
-                data['dh_fit_dx'] = fi[g+'/land_ice_segments/fit_statistics/dh_fit_dx'][:]
-                data['tide_earth'] = fi[g+'/land_ice_segments/geophysical/tide_earth'][:]
-                data['tide_load'] = fi[g+'/land_ice_segments/geophysical/tide_load'][:]
-                data['tide_ocean'] = fi[g+'/land_ice_segments/geophysical/tide_ocean'][:]
-                data['tide_pole'] = fi[g+'/land_ice_segments/geophysical/tide_pole'][:]
-                
-                rgt = fi['/orbit_info/rgt'][:]                           # single value
-                t_ref = fi['/ancillary_data/atlas_sdp_gps_epoch'][:]     # single value
-                beam_type = fi[g].attrs["atlas_beam_type"].decode()      # strong/weak (str)
-                spot_number = fi[g].attrs["atlas_spot_number"].decode()  # number (str)
-                
-        except:
-            print('skeeping group:', g)
-            print('in file:', fname)
+            return read_beam(fi, g, bbox, lat_stride, schema)
+        except (KeyError, OSError):
+            return None
+
+    if nthreads > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=nthreads) as pool:
+            results = list(pool.map(read, beams))
+    else:
+        results = [read(g) for g in beams]
+
+    return {g: r for g, r in zip(beams, results) if r is not None}
+
+
+def read_atl06_beams(fname, beams=BEAMS, nthreads=1, bbox=None, lat_stride=1,
+                     columns=None, schema=ATL06_SCHEMA):
+    """Read all beams of one ATL06 file into a single columnar dict.
+
+    The file is opened once and the shared ancillary fields are read
+    once. Beam variables are concatenated along track, with an extra
+    'beam' column holding the beam name (e.g. b'gt1l') of each segment.
+
+    Returns (data, attrs) where attrs holds 'rgt', 'cycle', 't_ref' and the
+    per-beam 'beam_type' and 'spot_number' dicts.
+
+    If `bbox` is given, only the along-track range overlapping its
+    latitude bounds is read; no exact lon/lat masking is applied.
+    Only `columns` (names from `schema`, default all) are read.
+    """
+    schema = project_schema(columns, schema)
+
+    with h5py.File(fname, 'r') as fi:
+        attrs = read_ancillary(fi)
+        beam_data = read_beams(fi, beams, nthreads, bbox, lat_stride, schema)
+
+    attrs['beam_type'] = {g[1:]: a['beam_type'] for g, (d, a) in beam_data.items()}
+    attrs['spot_number'] = {g[1:]: a['spot_number'] for g, (d, a) in beam_data.items()}
+
+    data = {}
+    for v in schema:
+        arrays = [d[v.name] for d, a in beam_data.values()]
+        data[v.name] = np.concatenate(arrays) if arrays else np.array([], dtype=v.dtype)
+
+    sizes = [len(d[schema[0].name]) if schema else 0 for d, a in beam_data.values()]
+    data['beam'] = np.concatenate(
+        [np.full(n, g[1:], dtype='S4') for g, n in zip(beam_data, sizes)]
+    ) if beam_data else np.array([], dtype='S4')
+
+    return data, attrs
+
+
+def iter_atl06(fname, epsg, bbox=None, nthreads=1, pushdown=True, lat_stride=1,
+               columns=None, schema=ATL06_SCHEMA, strict=False, verbose=True,
+               filters=None, stats=None):
+    """Read and filter one ATL06 file, yielding one beam at a time.
+
+    Yields (beam, data, attrs) with beam the beam name (e.g. 'gt1l'), data
+    a dict of the filtered columns, including x/y in `epsg`, times and the
+    orbit type, and attrs the granule and beam metadata (rgt, cycle,
+    t_ref, beam_type, spot_number), for every beam with data left.
+    Nothing is written to disk, so the beams can go straight to a
+    downstream stage, e.g.
+
+        for beam, data, attrs in iter_atl06(fname, DEM.epsg, bbox):
+            data['h_dem'] = DEM.sample_xy(data['x'], data['y'])
+
+    See read_atl06 for the other arguments.
+    """
+    if filters is None:
+        filters = default_filters(bbox)
+    elif bbox and not any(f.name == 'bbox' for f in filters):
+        # bbox is applied exactly, not only as the latitude range read
+        filters = [bbox_filter(bbox)] + list(filters)
+
+    required = REQUIRED_VARS + [k for f in filters for k in f.columns]
+    read_schema = project_schema(columns, schema, required)
+
+    #-----------------------------------------------------#
+    # 1) Read in ancillary data and all beams in one pass #
+    #-----------------------------------------------------#
+
+    try:
+        with h5py.File(fname, 'r') as fi:
+            ancillary = read_ancillary(fi)
+            beam_data = read_beams(fi, BEAMS, nthreads,
+                                   bbox if pushdown else None, lat_stride,
+                                   read_schema)
+    except (KeyError, OSError):
+        if strict:
+            raise
+        if verbose:
+            print('skeeping file:', fname)
+        return
+
+    # Loop trough beams
+    for g in BEAMS:
+
+        if g not in beam_data:
+            if verbose:
+                print('skeeping group:', g)
+                print('in file:', fname)
             continue
+
+        data, attrs = beam_data[g]
+        attrs = dict(ancillary, **attrs)
             
         #---------------------------------------------#
         # 2) Filter data according region and quality #
         #---------------------------------------------#
         
-        # Select a region of interest
-        if bbox:
-            lonmin, latmin, lonmax, latmax = bbox
-            bbox_mask = (data['lon'] >= lonmin) & (data['lon'] <= lonmax) & \
-                        (data['lat'] >= latmin) & (data['lat'] <= latmax)
-        else:
-            bbox_mask = np.ones_like(data['lat'], dtype=bool)  # get all
-            
-        # Compute segment difference mask
-        diff_mask = segment_diff_filter(data['dh_fit_dx'], data['h_li'], tol=2)
-            
-        # Only keep good data (quality flag + threshold + bbox)
-        mask = (data['q_flag'] == 0) & (np.abs(data['h_li']) < 10e3) & (bbox_mask == 1) & diff_mask
+        # Only keep good data (quality flag + threshold + bbox + ...)
+        mask = apply_filters(data, filters, stats=stats)
         
         # If no data left, skeep
-        if not any(mask): continue
+        if not mask.any(): continue
         
         # Update data variables
         for k, v in data.items(): data[k] = v[mask]
@@ -150,7 +506,7 @@ def read_atl06(fname, epsg, outdir='data', bbox=None):
         #----------------------------------------------------#
         
         # Time in GPS seconds (secs sinde Jan 5, 1980)
-        t_gps = t_ref + data['t_dt']
+        t_gps = attrs['t_ref'] + data['t_dt']
 
         # Time in decimal years
         t_year = gps2dyr(t_gps)
@@ -161,64 +517,284 @@ def read_atl06(fname, epsg, outdir='data', bbox=None):
         # Geodetic lon/lat -> Polar Stereo x/y
         x, y = transform_coord(4326, epsg, data['lon'], data['lat'])
         
+        # Drop variables only read for filtering
+        if columns is not None:
+            data = {k: v for k, v in data.items() if k in columns}
+
         data['x'] = x
         data['y'] = y
         data['t_gps'] = t_gps
         data['t_year'] = t_year
         data['is_asc'] = is_asc
-        
+
+        yield g[1:], data, attrs
+
+
+# Derived variables, recomputed from 't_dt' and the 't_ref' attribute on read
+DERIVED_VARS = ['t_gps', 't_year']
+
+# Dtypes of the written variables not in the read schema
+OUTPUT_DTYPES = {'x': 'f8', 'y': 'f8', 't_gps': 'f8', 't_year': 'f8', 'is_asc': 'bool'}
+
+
+def write_h5(outfile, data, attrs=None, compression='gzip', compression_opts=4,
+             chunk_size=10000, dtypes=OUTPUT_DTYPES):
+    """Write variables as chunked, shuffled and compressed datasets.
+
+    Variables are cast to `dtypes` where given (e.g. bool flags, int8
+    codes); attrs are stored as file attributes. Files use the HDF5 1.10
+    format, whose chunk indexes are much smaller for short tracks.
+    """
+    with h5py.File(outfile, 'w', libver=('v110', 'latest')) as fo:
+        for k, v in data.items():
+            v = np.asarray(v, dtype=dtypes.get(k))
+            fo.create_dataset(k, data=v, chunks=(min(chunk_size, max(len(v), 1)),),
+                              compression=compression, compression_opts=compression_opts,
+                              shuffle=compression is not None)
+        for k, v in (attrs or {}).items():
+            fo.attrs[k] = v
+
+
+def read_atl06(fname, epsg, outdir='data', bbox=None, nthreads=1,
+               pushdown=True, lat_stride=1, columns=None, schema=ATL06_SCHEMA,
+               strict=False, verbose=True, filters=None, stats=None,
+               compression='gzip', compression_opts=4, store_derived=False):
+    """Read one ATL06 file and output 6 reduced files. 
+    
+    Extract variables of interest and separate the ATL06 file 
+    into each beam (ground track) and ascending/descending orbits.
+    The file is opened only once for all beams.
+
+    With `pushdown` (and a bbox), latitude is read first (every
+    `lat_stride`-th value) and only the overlapping along-track
+    slice of the other variables is read from disk.
+
+    Only `columns` (names from `schema`, default all) plus the variables
+    needed by the filters and derived outputs are read, and only
+    `columns` plus the derived x/y, time and orbit variables are written.
+
+    `filters` is a list of Filter stages (default: default_filters(bbox)),
+    applied in one chunked pass; if `bbox` is given and no stage is named
+    'bbox', bbox_filter(bbox) is added. Pass a `stats` dict to collect the
+    number of points removed by each stage (see apply_filters).
+
+    Variables are written with compact dtypes (the schema dtypes and
+    OUTPUT_DTYPES), chunked, shuffled and compressed (see write_h5).
+    Unless `store_derived`, t_gps and t_year are not stored; read_h5
+    recomputes them from t_dt and the 't_ref' attribute.
+
+    `fname` may also be a file-like object with a `name` (e.g. a granule
+    downloaded into an io.BytesIO), which h5py opens directly.
+
+    Returns a dict {output file: number of points}. If `strict`, an
+    unreadable file raises instead of being skipped with a message.
+    Use iter_atl06 to get the beams in memory without writing files.
+    """
+    outfiles = {}
+
+    # Keep t_dt to recompute the derived variables on read
+    if columns is not None and not store_derived and 't_dt' not in columns:
+        columns = list(columns) + ['t_dt']
+
+    beams = iter_atl06(fname, epsg, bbox, nthreads, pushdown, lat_stride,
+                       columns, schema, strict, verbose, filters, stats)
+
+    dtypes = dict(OUTPUT_DTYPES, **{v.name: v.dtype for v in schema})
+
+    for beam, data, attrs in beams:
+
         #-----------------------#
         # 4) Save selected data #
         #-----------------------#
         
-        # Define output dir and file
+        # Define output dir and file (fname may be a named file-like object)
         outdir = Path(outdir)    
-        fname = Path(fname)
         outdir.mkdir(exist_ok=True)
-        outfile = outdir / fname.name.replace('.h5', '_' + g[1:] + '.h5')
+        outfile = outdir / Path(getattr(fname, 'name', fname)).name.replace('.h5', '_' + beam + '.h5')
         
+        # Drop the derived variables (read_h5 recomputes them from t_dt)
+        if not store_derived:
+            data = {k: v for k, v in data.items() if k not in DERIVED_VARS}
+
+        attrs = dict(attrs, beam=beam, epsg=str(epsg))
+
         # Save variables
-        with h5py.File(outfile, 'w') as fo:
-            for k, v in data.items(): fo[k] = v
+        write_h5(outfile, data, attrs, compression, compression_opts, dtypes=dtypes)
+        if verbose:
             print('out ->', outfile)
 
+        outfiles[str(outfile)] = len(data['x'])
+
+    return outfiles
+
+def read_variable(f, name, sl=slice(None)):
+    """Read (a slice of) a variable from an open reduced file.
+
+    Derived variables not stored in the file are recomputed.
+    """
+    if name in f or name not in DERIVED_VARS:
+        return f[name][sl]
+    t_gps = f.attrs['t_ref'] + f['t_dt'][sl]
+    return t_gps if name == 't_gps' else gps2dyr(t_gps)
+
+
+def h5_variables(f):
+    """Names of all variables of an open reduced file, incl. derived ones."""
+    vnames = [key for key in f.keys()]
+    if 't_ref' in f.attrs:
+        vnames += [k for k in DERIVED_VARS if k not in f]
+    return vnames
+
+
 def read_h5(fname, vnames=None):
-    """Read hdf5 file and return all variables"""
+    """Read hdf5 file and return all variables (incl. derived ones)"""
     with h5py.File(fname, 'r') as f:
         if not vnames:
-            vnames = [key for key in f.keys()]
-        return np.column_stack([f[v][()] for v in vnames]), vnames
+            vnames = h5_variables(f)
+        return np.column_stack([read_variable(f, v) for v in vnames]), vnames
     
     
-def points_in_polygon(points_geometry, shp_filename):
+@lru_cache(maxsize=8)
+def _read_polygons(shp_filename, size, mtime):
+    """Read a polygon shapefile and build its spatial index (cached)."""
+    import geopandas as gpd
+    from shapely import STRtree
+
+    shapefile = gpd.read_file(shp_filename)
+    geoms = np.asarray(shapefile.geometry.values, dtype=object)
+    return shapefile, STRtree(geoms), shapefile.total_bounds
+
+
+def read_polygons(shp_filename, cache=True):
+    """Return (GeoDataFrame, STRtree, bounds) for a polygon shapefile.
+
+    With `cache`, repeated calls for an unchanged file reuse the result.
+    """
+    if not cache:
+        return _read_polygons.__wrapped__(str(shp_filename), None, None)
+    st = Path(shp_filename).stat()
+    return _read_polygons(str(shp_filename), st.st_size, st.st_mtime)
+
+
+def polygon_mask(shp_filename, raster_path, cache_dir=None):
+    """Rasterize polygons on the grid of a raster (e.g. the DEM).
+
+    Polygons are reprojected to the raster CRS. Returns (poly_id,
+    transform, crs): an int32 array on the raster grid with the shapefile
+    row number of the polygon covering each pixel center (-1 if none),
+    and the raster's affine transform and CRS (None if the raster has
+    none, in which case the polygons are used as they are). The array is
+    cached in `cache_dir` (default ~/.cache/simlib), keyed by the
+    shapefile (path, size, mtime) and the raster grid (transform, shape,
+    CRS).
+    """
+    import rasterio
+    from rasterio.features import rasterize
+
+    with rasterio.open(raster_path) as src:
+        transform, shape, crs = src.transform, src.shape, src.crs
+
+    st = Path(shp_filename).stat()
+    key = json.dumps([str(Path(shp_filename).resolve()), st.st_size, st.st_mtime,
+                      list(transform)[:6], list(shape), crs.to_string() if crs else None])
+    cache_dir = Path(cache_dir) if cache_dir else Path.home() / '.cache' / 'simlib'
+    cache_file = cache_dir / ('mask_' + hashlib.sha1(key.encode()).hexdigest() + '.npy')
+
+    if cache_file.exists():
+        return np.load(cache_file), transform, crs
+
+    shapefile = read_polygons(shp_filename)[0]
+    if shapefile.crs is not None and crs is not None:
+        shapefile = shapefile.to_crs(crs)
+    shapes = ((geom, i + 1) for i, geom in enumerate(shapefile.geometry) if geom is not None)
+    poly_id = rasterize(shapes, out_shape=shape, transform=transform,
+                        fill=0, dtype='int32') - 1
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp = cache_file.with_suffix('.tmp.npy')
+    np.save(tmp, poly_id)
+    tmp.replace(cache_file)
+
+    return poly_id, transform, crs
+
+
+def points_in_polygon(points_geometry, shp_filename, return_id=False,
+                      id_column=None, cache=True, raster=None, cache_dir=None):
     # points_geometry: N-by-2 np array or GeoDataFram or GeoSeries defining the geometry of points
     # shp_filename: (multi-)polygon shapefile name 
     # Both datasets should have the SAME CRS!
 
-    # return: np mask array showing where the targeted points are.
+    # return: boolean Series showing where the targeted points are.
+    # If return_id, also return the matched polygon ID for each point: the
+    # shapefile row number (-1 if none), or the value of `id_column` (None if none).
+    # Polygons are looked up through an STRtree, after a bbox pre-filter.
+    # If raster (a raster path or reference_dem) is given, points are instead
+    # classified by the pixel they fall in, on a mask rasterized once at the
+    # raster resolution (see polygon_mask); points off the grid use the
+    # polygons. Pixel classification is approximate at polygon edges.
+    # Points are reprojected from the shapefile CRS to the raster CRS for
+    # the pixel lookup.
 
-    # import logging
-    # logging.basicConfig(level=logging.WARNING)
     import geopandas as gpd
-    from shapely.geometry import Point
-    # from shapely.geometry import mapping
+    import pandas as pd
+    import shapely
 
-    shapefile = gpd.read_file(shp_filename)
-    poly_geometries = [shapefile.loc[i]['geometry'] for i in range(len(shapefile))]
-    if type(points_geometry) is gpd.GeoDataFrame:
-        pt_gs = gpd.GeoSeries(points_geometry.geometry)
-    elif type(points_geometry) is gpd.GeoSeries:
+    shapefile, tree, bounds = read_polygons(shp_filename, cache)
+
+    if isinstance(points_geometry, gpd.GeoDataFrame):
+        pt_gs = points_geometry.geometry
+    elif isinstance(points_geometry, gpd.GeoSeries):
         pt_gs = points_geometry
     else:
-        pt_geometries = [Point(xy) for xy in zip(points_geometry[:, 0], points_geometry[:, 1])]
-        pt_gs = gpd.GeoSeries(pt_geometries)
-
-    idx = None
-    for single_poly in poly_geometries:
-        if idx is None:
-            idx = pt_gs.within(single_poly)
-        else:
-            tmp = pt_gs.within(single_poly)
-            idx = np.logical_or(idx, tmp)
-
-    return idx
\ No newline at end of file
+        pt_gs = None
+
+    if pt_gs is not None:
+        index = pt_gs.index
+        x, y = pt_gs.x.to_numpy(), pt_gs.y.to_numpy()
+    else:
+        points_geometry = np.asarray(points_geometry)
+        index = pd.RangeIndex(len(points_geometry))
+        x, y = points_geometry[:, 0], points_geometry[:, 1]
+
+    poly = np.full(len(x), -1)
+    i_vec = np.arange(len(x))
+
+    if raster is not None:
+        mask, transform, crs = polygon_mask(shp_filename, getattr(raster, 'path', raster),
+                                            cache_dir)
+        xr, yr = x, y
+        if shapefile.crs is not None and crs is not None and shapefile.crs != crs:
+            import pyproj
+            transformer = pyproj.Transformer.from_crs(shapefile.crs, crs, always_xy=True)
+            xr, yr = transformer.transform(x, y)
+        col, row = ~transform * (xr, yr)
+        col, row = np.floor(col), np.floor(row)
+        on_grid = (row >= 0) & (row < mask.shape[0]) & (col >= 0) & (col < mask.shape[1])
+        poly[on_grid] = mask[row[on_grid].astype(int), col[on_grid].astype(int)]
+        i_vec, = np.where(~on_grid)
+
+    # Only test points within the bounds of all polygons
+    xmin, ymin, xmax, ymax = bounds
+    xv, yv = x[i_vec], y[i_vec]
+    i_cand = i_vec[(xv >= xmin) & (xv <= xmax) & (yv >= ymin) & (yv <= ymax)]
+
+    i_pts, i_poly = tree.query(shapely.points(x[i_cand], y[i_cand]), predicate='within')
+    poly[i_cand[i_pts]] = i_poly
+
+    i_pts, = np.where(poly >= 0)
+    i_poly = poly[i_pts]
+
+    idx = np.zeros(len(x), dtype=bool)
+    idx[i_pts] = True
+    idx = pd.Series(idx, index=index)
+
+    if not return_id:
+        return idx
+
+    if id_column is None:
+        poly_id = poly
+    else:
+        poly_id = np.full(len(x), None, dtype=object)
+        poly_id[i_pts] = shapefile[id_column].to_numpy()[i_poly]
+
+    return idx, pd.Series(poly_id, index=index)
@@ -0,0 +1,121 @@
+"""
+On-disk cache of API responses.
+
+Entries are raw response bodies stored as files named by the SHA-1 of
+the normalized request (URL and sorted, stringified parameters), so the
+same query always maps to the same file whatever the parameter order or
+types. The file mtime is the time the entry was written (used for the
+TTL) and the atime the time it was last used: when the cache grows past
+`max_bytes`, the least recently used entries are evicted.
+
+Files are written atomically, so several processes can share a cache.
+"""
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+
+# Default cache directory, shared with other simlib caches
+CACHE_DIR = Path.home() / '.cache' / 'simlib'
+
+
+def request_key(url, params):
+    """Key of a request: SHA-1 of its URL and normalized parameters."""
+    params = {str(k): str(v) for k, v in dict(params).items()}
+    key = json.dumps([url, params], sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+class ResponseCache:
+    """Size-bounded LRU cache of responses on disk.
+
+    path: cache directory (default ~/.cache/simlib/responses)
+    max_bytes: total size above which least recently used entries are evicted
+    ttl: max age (s) of an entry, None for no expiry
+    """
+
+    def __init__(self, path=None, max_bytes=2e9, ttl=None):
+        self.path = Path(path) if path else CACHE_DIR / 'responses'
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+        self.nbytes = sum(f.stat().st_size for f in self.path.glob('*.cache'))
+
+    def _file(self, key):
+        return self.path / (key + '.cache')
+
+    def get(self, key):
+        """Return the cached bytes of `key`, or None if missing or expired."""
+        fname = self._file(key)
+        try:
+            st = fname.stat()
+            if self.ttl is not None and time.time() - st.st_mtime > self.ttl:
+                data = None
+            else:
+                data = fname.read_bytes()
+                # mark as recently used, keeping the write time
+                os.utime(fname, (time.time(), st.st_mtime))
+        except FileNotFoundError:
+            data = None
+        with self.lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def put(self, key, data):
+        """Store bytes under `key` and evict old entries if over the limit."""
+        fname = self._file(key)
+        # unique temporary file, whatever the process and thread
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            try:
+                old = fname.stat().st_size
+            except FileNotFoundError:
+                old = 0
+            os.replace(tmp, fname)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        with self.lock:
+            self.nbytes += len(data) - old
+            if self.nbytes > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """Remove expired entries, then least recently used ones until
+        the cache fits in max_bytes."""
+        now = time.time()
+        entries = []
+        for f in self.path.glob('*.cache'):
+            try:
+                st = f.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_atime, st.st_mtime, st.st_size, f))
+
+        entries.sort()
+        nbytes = sum(e[2] for e in entries)
+        for atime, mtime, size, f in entries:
+            expired = self.ttl is not None and now - mtime > self.ttl
+            if not expired and nbytes <= self.max_bytes:
+                continue
+            try:
+                f.unlink()
+            except FileNotFoundError:
+                pass
+            nbytes -= size
+        self.nbytes = nbytes
+
+    def clear(self):
+        for f in self.path.glob('*.cache'):
+            f.unlink()
+        self.nbytes = 0
@@ -0,0 +1,200 @@
+"""
+Granule search in NASA's Common Metadata Repository (CMR).
+
+The search reads the number of hits from the first page and fetches the
+remaining pages concurrently (by page number). The result is a compact
+granule table with one row per data file: granule name, URL, size, time
+range and footprint polygon, so later stages can filter granules
+without searching again. Tables are cached on disk, keyed by the search
+parameters, for `ttl` seconds.
+
+`intersecting` drops granules whose footprint misses a region (e.g. the
+valid-data footprint of the DEM) before anything is downloaded.
+"""
+import json
+import math
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import requests
+
+from simlib.cache import CACHE_DIR, ResponseCache, request_key
+
+CMR_URL = 'https://cmr.earthdata.nasa.gov'
+CMR_GRANULES_URL = CMR_URL + '/search/granules.json'
+CMR_PAGE_SIZE = 2000
+
+
+def version_params(version):
+    """All zero-paddings of a version, as CMR matches them literally."""
+    version = str(int(version))
+    return [version.zfill(n) for n in range(3, len(version) - 1, -1)]
+
+
+def query_params(short_name, version, time_start, time_end, bounding_box=None,
+                 polygon=None, filename_filter=None, provider='NSIDC_ECS'):
+    """CMR granule query parameters (as in the NSIDC download script)."""
+    params = {
+        'provider': provider,
+        'short_name': short_name,
+        'version': version_params(version),
+        'temporal[]': f'{time_start},{time_end}',
+        'sort_key[]': ['start_date', 'producer_granule_id'],
+    }
+    if polygon:
+        params['polygon'] = polygon if isinstance(polygon, str) else ','.join(map(str, polygon))
+    elif bounding_box:
+        params['bounding_box'] = (bounding_box if isinstance(bounding_box, str)
+                                  else ','.join(map(str, bounding_box)))
+    if filename_filter:
+        params['producer_granule_id[]'] = filename_filter
+        params['options[producer_granule_id][pattern]'] = 'true'
+    return params
+
+
+def data_urls(links):
+    """Data links of a granule (skipping inherited, OPeNDAP and duplicate files)."""
+    urls = []
+    filenames = set()
+    for link in links:
+        if 'href' not in link or link.get('inherited') is True:
+            continue
+        # '.../data#' only, not '.../metadata#'
+        if 'rel' in link and not link['rel'].endswith('/data#'):
+            continue
+        if 'opendap' in link.get('title', '').lower():
+            continue
+        filename = link['href'].split('/')[-1]
+        if filename in filenames:
+            continue
+        filenames.add(filename)
+        urls.append(link['href'])
+    return urls
+
+
+def footprint(entry):
+    """Footprint of a granule (shapely, lon/lat) from its CMR spatial metadata."""
+    from shapely.geometry import Polygon, MultiPolygon, LineString, MultiLineString, box
+
+    def points(s):
+        # CMR lists 'lat lon lat lon ...'
+        latlon = np.array(s.split(), dtype=float).reshape(-1, 2)
+        return latlon[:, ::-1]
+
+    if 'polygons' in entry:
+        polys = [Polygon(points(rings[0]), [points(r) for r in rings[1:]])
+                 for rings in entry['polygons']]
+        return polys[0] if len(polys) == 1 else MultiPolygon(polys)
+    if 'boxes' in entry:
+        boxes = []
+        for b in entry['boxes']:
+            s, w, n, e = map(float, b.split())
+            boxes.append(box(w, s, e, n))
+        return boxes[0] if len(boxes) == 1 else MultiPolygon(boxes)
+    if 'lines' in entry:
+        lines = [LineString(points(s)) for s in entry['lines']]
+        return lines[0] if len(lines) == 1 else MultiLineString(lines)
+    return None
+
+
+def granule_records(page):
+    """Granule table rows of one CMR result page, one per data link (footprints as WKT)."""
+    records = []
+    for e in page.get('feed', {}).get('entry', []):
+        geom = footprint(e)
+        for url in data_urls(e.get('links', [])):
+            records.append({
+                'granule': e.get('producer_granule_id') or e.get('title'),
+                'url': url,
+                'size_mb': float(e['granule_size']) if 'granule_size' in e else np.nan,
+                'time_start': e.get('time_start'),
+                'time_end': e.get('time_end'),
+                'footprint': geom.wkt if geom is not None else None,
+            })
+    return records
+
+
+def granule_table(records):
+    """GeoDataFrame (EPSG:4326) of granule records, one row per file."""
+    import geopandas as gpd
+    import shapely
+
+    df = pd.DataFrame(records, columns=['granule', 'url', 'size_mb', 'time_start',
+                                        'time_end', 'footprint'])
+    df = df.dropna(subset=['url'])
+    df = df[~df['url'].str.split('/').str[-1].duplicated()].reset_index(drop=True)
+    for col in ['time_start', 'time_end']:
+        df[col] = pd.to_datetime(df[col], utc=True)
+    df['footprint'] = shapely.from_wkt(df['footprint'].to_numpy(dtype=object))
+    return gpd.GeoDataFrame(df, geometry='footprint', crs='EPSG:4326')
+
+
+def search_granules(short_name, version, time_start, time_end, bounding_box=None,
+                    polygon=None, filename_filter=None, provider='NSIDC_ECS',
+                    page_size=CMR_PAGE_SIZE, nworkers=4, cache=True, ttl=86400,
+                    session=None, verbose=True):
+    """Search CMR for granules and return the granule table.
+
+    time_start, time_end: 'yyyy-mm-ddThh:mm:ssZ'
+    bounding_box: [lonmin, latmin, lonmax, latmax] (or 'w,s,e,n')
+    polygon: lon/lat pairs, counterclockwise (or 'lon,lat,lon,lat,...')
+    cache: True for ~/.cache/simlib/cmr, a ResponseCache, or False
+    ttl: max age (s) of a cached search (only used with cache=True)
+
+    Returns a GeoDataFrame with granule, url, size_mb, time_start,
+    time_end and footprint (geometry, EPSG:4326).
+    """
+    params = query_params(short_name, version, time_start, time_end, bounding_box,
+                          polygon, filename_filter, provider)
+
+    if cache is True:
+        cache = ResponseCache(CACHE_DIR / 'cmr', ttl=ttl)
+    if cache:
+        key = request_key(CMR_GRANULES_URL, {k: json.dumps(v) for k, v in params.items()})
+        content = cache.get(key)
+        if content is not None:
+            return granule_table(json.loads(content))
+
+    session = session or requests.Session()
+
+    def get_page(page_num):
+        r = session.get(CMR_GRANULES_URL, timeout=60,
+                        params=dict(params, page_size=page_size, page_num=page_num))
+        r.raise_for_status()
+        return r
+
+    first = get_page(1)
+    hits = int(first.headers.get('CMR-Hits', 0))
+    npages = math.ceil(hits / page_size)
+    if verbose:
+        print('Found {0} matches.'.format(hits) if hits else 'Found no matches.')
+
+    pages = [first.json()]
+    if npages > 1:
+        with ThreadPoolExecutor(max_workers=nworkers) as pool:
+            pages += [r.json() for r in pool.map(get_page, range(2, npages + 1))]
+
+    records = list(itertools.chain.from_iterable(granule_records(p) for p in pages))
+    if cache:
+        cache.put(key, json.dumps(records).encode())
+
+    return granule_table(records)
+
+
+def intersecting(granules, region, buffer=0.0):
+    """Granules whose footprint intersects region.
+
+    granules: granule table (see search_granules)
+    region: shapely geometry in lon/lat, e.g. reference_dem.footprint()
+        (the valid-data outline of the DEM rather than its bbox)
+    buffer: margin (deg) added around region
+    Granules without footprint metadata are kept.
+    """
+    if buffer:
+        region = region.buffer(buffer)
+    hit = np.zeros(len(granules), dtype=bool)
+    hit[granules.sindex.query(region, predicate='intersects')] = True
+    hit |= granules.geometry.isna().to_numpy()
+    return granules[hit]
@@ -1,3 +1,6 @@
 # global parameters
+import os
+
 beamlist = ['gt1r', 'gt1l', 'gt2r', 'gt2l', 'gt3r', 'gt3l']
-base_url = 'https://openaltimetry.org/data/api/icesat2/level3a'
+# OpenAltimetry API endpoint, override with SIMLIB_OA_URL (e.g. a local simlib.oaserver)
+base_url = os.environ.get('SIMLIB_OA_URL', 'https://openaltimetry.org/data/api/icesat2/level3a')
@@ -5,7 +5,7 @@
 import gdal
 import osr
 import numpy as np
-import pyproj
+from simlib import projection
 import rasterio
 from rasterio.plot import show as rio_show
 from rasterio.mask import mask
@@ -19,6 +19,9 @@ class reference_dem:
         self.calculate_bounding_box(self.epsg)
         self.path = dem_file_path
 
+    def __repr__(self):
+        return 'reference_dem({!r})'.format(self.path)
+
     ##################################################################################
     # These are functions to initiate the DEM object and create the bounding box
 
@@ -44,11 +47,9 @@ class reference_dem:
         else:
             raise TypeError('DEM type not recognized')
     
-    #defintition to transform coordinates from F. Paolo's tutorial
+    #defintition to transform coordinates from F. Paolo's tutorial (x/y order)
     def transform_coord(self,proj1, proj2, x, y):
-        proj1 = pyproj.Proj("EPSG:"+str(proj1))
-        proj2 = pyproj.Proj("EPSG:"+str(proj2))
-        return pyproj.transform(proj1, proj2, x, y)
+        return projection.transform_coord(proj1, proj2, x, y)
 
 
     def calculate_bounding_box(self,epsg):
@@ -60,7 +61,7 @@ class reference_dem:
                                    [self.x.max(),self.y.min()],
                                    [self.x.max(),self.y.max()],
                                    [self.x.min(),self.y.max()]])
-            t_y, t_x = self.transform_coord(int(self.epsg), epsg, bbox_corners[:,0], bbox_corners[:,1])
+            t_x, t_y = self.transform_coord(int(self.epsg), epsg, bbox_corners[:,0], bbox_corners[:,1])
             self.bbox = [t_x.min(),t_y.min(),t_x.max(),t_y.max()]
             self.bbox_epsg = str(epsg)
             
@@ -153,4 +154,60 @@ class reference_dem:
         # print(h_raster)
         new_gdf_array = gdf_array.copy()
         new_gdf_array[tag] = h_raster
-        return new_gdf_array
\ No newline at end of file
+        return new_gdf_array
+
+    def sample_xy(self, x, y):
+
+        """
+        Sample the dem at point coordinates x, y (same projection as the dem)
+        with a vectorized lookup of the pixel each point falls in.
+        Works on plain arrays, e.g. the beams yielded by atl06lib.iter_atl06.
+        Points outside the dem are NaN.
+        """
+        x, y = np.asarray(x), np.asarray(y)
+        dx, dy = self.x[1] - self.x[0], self.y[1] - self.y[0]
+        col = np.floor((x - self.x[0]) / dx)
+        row = np.floor((y - self.y[0]) / dy)
+        inside = (col >= 0) & (col < self.dem.shape[1]) & (row >= 0) & (row < self.dem.shape[0])
+        h = np.full(x.shape, np.nan)
+        h[inside] = self.dem[row[inside].astype(int), col[inside].astype(int)]
+        return h
+
+    def footprint(self, epsg=4326, max_pixels=1000000):
+
+        """
+        Return the outline of the valid (not nodata) part of the dem as a
+        shapely geometry in the given projection (default lon/lat).
+        The validity mask is read decimated to at most max_pixels pixels,
+        polygonized, and buffered by one (decimated) pixel so that the
+        footprint contains all valid data. Edges are densified before the
+        reprojection. The result is cached per epsg.
+        """
+        from rasterio.features import shapes
+        import shapely
+        from shapely.geometry import shape
+        from shapely.ops import unary_union, transform as shapely_transform
+
+        cache = self.__dict__.setdefault('_footprints', {})
+        if epsg in cache:
+            return cache[epsg]
+
+        with rasterio.open(self.path) as src:
+            factor = max(1, int(np.ceil(np.sqrt(src.width * src.height / max_pixels))))
+            out_shape = (max(1, src.height // factor), max(1, src.width // factor))
+            valid = src.dataset_mask(out_shape=out_shape) > 0
+            transform = src.transform * src.transform.scale(src.width / out_shape[1],
+                                                            src.height / out_shape[0])
+
+        pixel = max(abs(transform.a), abs(transform.e))
+        polys = [shape(geom) for geom, value in shapes(valid.astype(np.uint8), mask=valid,
+                                                       transform=transform)]
+        outline = unary_union(polys).buffer(pixel).simplify(pixel / 2)
+
+        if int(epsg) != int(self.epsg):
+            outline = shapely.segmentize(outline, 10 * pixel)
+            transformer = projection.get_transformer(int(self.epsg), int(epsg))
+            outline = shapely_transform(transformer.transform, outline)
+
+        cache[epsg] = outline
+        return outline
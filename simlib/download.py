@@ -0,0 +1,248 @@
+"""
+Concurrent downloads of NSIDC/Earthdata files (DEM tiles, ATL06 granules).
+
+Files are streamed to disk in chunks over a pooled session, several at a
+time. Each transfer writes to '<file>.part' and is renamed when complete,
+so an interrupted transfer is resumed with an HTTP Range request on the
+next attempt or run. Files already on disk with the expected size (and
+checksum, if known) are skipped.
+
+Earthdata Login redirects to urs.earthdata.nasa.gov and back; the
+session keeps the credentials across those redirects only.
+"""
+import io
+import os
+import time
+import netrc
+import hashlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from urllib.parse import urlparse
+
+import requests
+import requests.adapters
+
+URS_HOST = 'urs.earthdata.nasa.gov'
+
+# Outcome of one file: status is 'ok', 'skipped' (already complete) or 'failed'
+DownloadStatus = namedtuple(
+    'DownloadStatus', ['url', 'path', 'status', 'nbytes', 'seconds', 'error']
+)
+
+
+def file_checksum(fname, blocksize=2**20, algorithm='md5'):
+    """Checksum (hex digest) of a file, MD5 by default."""
+    h = hashlib.new(algorithm)
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def earthdata_auth():
+    """(username, password) of Earthdata Login from ~/.netrc, or None."""
+    try:
+        auth = netrc.netrc().authenticators(URS_HOST)
+    except (FileNotFoundError, netrc.NetrcParseError):
+        return None
+    return (auth[0], auth[2]) if auth else None
+
+
+class EarthdataSession(requests.Session):
+    """Session keeping the Authorization header across Earthdata redirects.
+
+    requests drops credentials when redirected to another host; here they
+    are kept when the redirect goes to or comes from the Earthdata Login
+    host, and dropped otherwise.
+    """
+
+    def __init__(self, auth=None, pool_size=10):
+        super().__init__()
+        self.auth = auth if auth is not None else earthdata_auth()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                                pool_maxsize=pool_size)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def rebuild_auth(self, prepared_request, response):
+        headers = prepared_request.headers
+        if 'Authorization' in headers:
+            original = urlparse(response.request.url).hostname
+            redirect = urlparse(prepared_request.url).hostname
+            if original != redirect and URS_HOST not in (original, redirect):
+                del headers['Authorization']
+
+
+def is_complete(path, size=None, checksum=None, algorithm='md5'):
+    """True if path exists with the given size and checksum (if not None)."""
+    path = Path(path)
+    if not path.exists():
+        return False
+    if size is not None and path.stat().st_size != size:
+        return False
+    if checksum is not None and file_checksum(path, algorithm=algorithm) != checksum.lower():
+        return False
+    return True
+
+
+def content_size(response):
+    """Total size of the file sent in a (partial) response, or None."""
+    if response.status_code == 206:
+        total = response.headers.get('Content-Range', '').rpartition('/')[2]
+        return int(total) if total.isdigit() else None
+    if 'Content-Encoding' in response.headers:
+        return None
+    length = response.headers.get('Content-Length')
+    return int(length) if length is not None else None
+
+
+def retryable(error):
+    """False for HTTP client errors (4xx) other than timeouts and rate limits."""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return True
+    return not (400 <= response.status_code < 500) or response.status_code in (408, 429)
+
+
+def transfer(session, url, f, size=None, chunk_size=2**20, timeout=60):
+    """Stream url into the file object f, resuming after its current end.
+
+    If f is not empty, only the missing range is requested; if the server
+    ignores the range, f is rewritten from the start. Returns the total
+    size of the file (size if given, else from the response headers).
+    """
+    f.seek(0, os.SEEK_END)
+    offset = f.tell()
+    headers = {'Range': f'bytes={offset}-'} if offset else {}
+
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as r:
+        if r.status_code == 416:
+            # Range not satisfiable: f is already complete
+            return size
+        r.raise_for_status()
+        if size is None:
+            size = content_size(r)
+        if r.status_code != 206:
+            f.seek(0)
+            f.truncate()
+        for chunk in r.iter_content(chunk_size):
+            f.write(chunk)
+    return size
+
+
+def download_file(session, url, outdir='.', size=None, checksum=None, algorithm='md5',
+                  chunk_size=2**20, retries=3, backoff=1.0, timeout=60):
+    """Download one file into outdir, resuming a partial download.
+
+    size, checksum: expected size (bytes) and hex digest (`algorithm`), if
+    known. The file is skipped if it is already complete; otherwise the
+    body is streamed in chunks to '<file>.part', resumed with a Range
+    request after errors, verified and renamed. Returns a DownloadStatus.
+    """
+    t0 = time.perf_counter()
+    path = Path(outdir) / url.split('/')[-1]
+    part = path.with_name(path.name + '.part')
+
+    if size is None and checksum is None and path.exists():
+        # Size of the remote file, to tell complete files from stale ones
+        try:
+            r = session.head(url, allow_redirects=True, timeout=timeout)
+            size = int(r.headers['Content-Length']) if r.ok and 'Content-Length' in r.headers else None
+        except requests.RequestException:
+            pass
+
+    if is_complete(path, size, checksum, algorithm):
+        return DownloadStatus(url, str(path), 'skipped', 0, time.perf_counter() - t0, None)
+
+    offset = part.stat().st_size if part.exists() else 0
+    error = None
+    for attempt in range(retries + 1):
+        try:
+            with open(part, 'a+b') as f:
+                size = transfer(session, url, f, size, chunk_size, timeout)
+
+            if size is not None and part.stat().st_size < size:
+                # keep the partial file, the next attempt resumes it
+                raise IOError(f'{path.name}: incomplete transfer')
+            if not is_complete(part, size, checksum, algorithm):
+                part.unlink()
+                raise IOError(f'{path.name}: size or checksum mismatch')
+
+            os.replace(part, path)
+            return DownloadStatus(url, str(path), 'ok', path.stat().st_size - offset,
+                                  time.perf_counter() - t0, None)
+
+        except (requests.RequestException, IOError) as e:
+            error = e
+            if attempt == retries or not retryable(e):
+                break
+            time.sleep(backoff * 2 ** attempt)
+
+    nbytes = part.stat().st_size - offset if part.exists() else 0
+    return DownloadStatus(url, str(path), 'failed', nbytes, time.perf_counter() - t0, str(error))
+
+
+def download_buffer(session, url, size=None, chunk_size=2**20, retries=3, backoff=1.0,
+                    timeout=60):
+    """Download one file into memory.
+
+    Returns an io.BytesIO positioned at the start, with `name` set to the
+    file name, which h5py.File (and read_atl06) can open directly.
+    Transfers are resumed with Range requests after errors, as in
+    download_file; raises the last error if all retries fail.
+    """
+    buf = io.BytesIO()
+    buf.name = url.split('/')[-1]
+
+    for attempt in range(retries + 1):
+        try:
+            size = transfer(session, url, buf, size, chunk_size, timeout)
+            if size is not None and buf.seek(0, os.SEEK_END) != size:
+                raise IOError(f'{buf.name}: incomplete transfer')
+            buf.seek(0)
+            return buf
+        except (requests.RequestException, IOError) as e:
+            if attempt == retries or not retryable(e):
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+
+def download_files(urls, outdir='.', sizes=None, checksums=None, algorithm='md5',
+                   nworkers=4, session=None, auth=None, verbose=True, **kwargs):
+    """Download files concurrently (see download_file).
+
+    urls: list of URLs
+    sizes, checksums: optional lists of expected sizes and checksums
+        (None entries for unknown), in the order of urls
+    nworkers: number of concurrent transfers
+    auth: (username, password), default from ~/.netrc
+    Extra keyword arguments are passed to download_file.
+
+    Returns a list of DownloadStatus, in completion order.
+    """
+    urls = list(urls)
+    sizes = [None] * len(urls) if sizes is None else [None if s is None or s != s else int(s)
+                                                      for s in sizes]
+    checksums = [None] * len(urls) if checksums is None else list(checksums)
+
+    Path(outdir).mkdir(parents=True, exist_ok=True)
+    session = session or EarthdataSession(auth, pool_size=nworkers)
+
+    if verbose:
+        print('Downloading {} files...'.format(len(urls)))
+
+    results = []
+    with ThreadPoolExecutor(max_workers=nworkers) as pool:
+        futures = [pool.submit(download_file, session, url, outdir, size, checksum,
+                               algorithm, **kwargs)
+                   for url, size, checksum in zip(urls, sizes, checksums)]
+        for index, future in enumerate(as_completed(futures), start=1):
+            r = future.result()
+            results.append(r)
+            if verbose:
+                print('{0}/{1}: {2} {3} ({4:.1f} MB, {5:.1f} s){6}'.format(
+                    str(index).zfill(len(str(len(urls)))), len(urls), Path(r.path).name,
+                    r.status, r.nbytes / 1e6, r.seconds, ' - ' + r.error if r.error else ''))
+
+    return results
@@ -2,12 +2,26 @@
 import glob
 import os
 import sys
-import re
+import json
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
+from itertools import chain, islice
 import requests
+import requests.adapters
 import numpy as np
 import pandas as pd
-from itertools import compress
+from pandas.api.types import union_categoricals
 import simlib.config as cn
+from simlib.cache import ResponseCache, request_key
+
+# HTTP status codes worth retrying
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# Per-point columns repeated along a beam, stored as categoricals
+CATEGORICAL = ['beam', 'cycle', 'time']
 
 def grid_bbox(bbox, binsize = 5):
     """
@@ -41,6 +55,50 @@ def grid_bbox(bbox, binsize = 5):
             
     return bbox_list
 
+# ATL06 granule names are fixed width:
+# ATL06_<yyyymmddhhmmss>_<rgt><cycle><region>_<release>_<version>.h5
+# field -> (start, stop) character positions
+GRANULE_FIELDS = {'rgt': (21, 25), 'cycle': (25, 27), 'region': (27, 29),
+                  'release': (30, 33), 'version': (34, 36)}
+
+GRANULE_DTYPES = {'rgt': 'int16', 'cycle': 'int8', 'region': 'int8',
+                  'release': 'int16', 'version': 'int8'}
+
+
+def parse_granules(filelist):
+    """
+    Parse ATL06 file names (or paths) in one vectorized pass
+    The names are viewed as a (n, 36) array of characters and the fields
+    read off their fixed positions.
+    Output:
+        dataframe with name, date (datetime64), rgt, cycle, region,
+        release, version (integers); names that do not match are dropped
+    """
+    names = np.array([os.path.basename(str(f)) for f in filelist], dtype=object)
+    chars = names.astype('U36').view(np.uint32).reshape(len(names), 36).astype(np.int64)
+    digits = chars - ord('0')
+
+    isdigit = (digits >= 0) & (digits <= 9)
+    valid = ((chars[:, :6] == [ord(c) for c in 'ATL06_']).all(1)
+             & (chars[:, [20, 29, 33]] == ord('_')).all(1)
+             & isdigit[:, 6:20].all(1) & isdigit[:, 21:29].all(1)
+             & isdigit[:, 30:33].all(1) & isdigit[:, 34:36].all(1))
+    digits = digits[valid]
+
+    def number(start, stop):
+        return digits[:, start:stop] @ 10 ** np.arange(stop - start - 1, -1, -1)
+
+    date = ((number(6, 10) - 1970).astype('datetime64[Y]').astype('datetime64[M]')
+            + (number(10, 12) - 1).astype('timedelta64[M]')).astype('datetime64[D]')
+    date = (date + (number(12, 14) - 1).astype('timedelta64[D]')
+            + (3600 * number(14, 16) + 60 * number(16, 18) + number(18, 20)).astype('timedelta64[s]'))
+
+    df = pd.DataFrame({'name': names[valid], 'date': date.astype('datetime64[ns]')})
+    for field, (start, stop) in GRANULE_FIELDS.items():
+        df[field] = number(start, stop).astype(GRANULE_DTYPES[field])
+    return df
+
+
 def file_meta(filelist,bbox):
     """
     Derive metadata from filename
@@ -53,24 +111,435 @@ def file_meta(filelist,bbox):
         cycle
         bbox
     """
-    file_re=re.compile('ATL06_(?P<date>\d+)_(?P<rgt>\d\d\d\d)(?P<cycle>\d\d)(?P<region>\d\d)_(?P<release>\d\d\d)_(?P<version>\d\d).h5')
-    
-    para_lists = [] # list of parameters for API query
-    
-    for fname in filelist:
-        
-        temp=file_re.search(fname)
-        rgt = temp['rgt'].strip("0")
-        cycle = temp['cycle'].strip("0")
-        f_date = temp['date']
-        ftime = f_date[:4] + '-' + f_date[4:6] + '-' + f_date[6:8]
-        
-        paras = [rgt, ftime, cycle, bbox]
-        para_lists.append(paras)
-    
+    meta = parse_granules(filelist)
+
+    rgt = meta['rgt'].astype(str).tolist()
+    cycle = meta['cycle'].astype(str).tolist()
+    ftime = np.datetime_as_string(meta['date'].to_numpy(), unit='D').tolist()
+
+    # list of parameters for API query
+    para_lists = [[r, t, c, bbox] for r, t, c in zip(rgt, ftime, cycle)]
+
     return para_lists
 
-def OA_request(paralist, product = 'atl06'):
+
+def npz_path(path):
+    """path with the '.npz' suffix np.savez adds"""
+    path = os.fspath(path)
+    return path if path.endswith('.npz') else path + '.npz'
+
+
+class GranuleCatalog:
+    """
+    Catalog of ATL06 granules parsed from their file names
+    Rows are sorted by (rgt, cycle, date) so lookups by RGT are binary
+    searches, and a date-sorted order is kept for date range lookups.
+    The catalog is saved as a .npz file and only new names are parsed
+    when it is updated.
+    """
+
+    def __init__(self, df=None):
+        if df is None:
+            df = parse_granules([])
+        self.df = df.sort_values(['rgt', 'cycle', 'date'], kind='stable').reset_index(drop=True)
+        self._rgt = self.df['rgt'].to_numpy()
+        self._by_date = np.argsort(self.df['date'].to_numpy(), kind='stable')
+        self._dates = self.df['date'].to_numpy()[self._by_date]
+
+    def __len__(self):
+        return len(self.df)
+
+    @classmethod
+    def from_files(cls, filelist):
+        return cls(parse_granules(filelist))
+
+    def update(self, filelist):
+        """Return the catalog with the granules of filelist added"""
+        names = pd.Series([os.path.basename(str(f)) for f in filelist], dtype=object)
+        new = names[~names.isin(self.df['name'])]
+        if not len(new):
+            return self
+        return GranuleCatalog(pd.concat([self.df, parse_granules(new)], ignore_index=True))
+
+    def save(self, path):
+        """Save the catalog as npz ('.npz' is appended to path if missing)"""
+        arrays = {col: self.df[col].to_numpy() for col in self.df}
+        arrays['name'] = arrays['name'].astype(str)
+        arrays['date'] = arrays['date'].astype('datetime64[s]')
+        np.savez(npz_path(path), **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(npz_path(path)) as f:
+            df = pd.DataFrame({col: f[col] for col in f.files})
+        df['name'] = df['name'].astype(object)
+        df['date'] = df['date'].astype('datetime64[ns]')
+        return cls(df)
+
+    @classmethod
+    def open(cls, path, filelist=()):
+        """Load the catalog at path (if any), add filelist and save it back"""
+        path = npz_path(path)
+        catalog = cls.load(path) if os.path.exists(path) else cls()
+        updated = catalog.update(filelist)
+        if updated is not catalog or not os.path.exists(path):
+            updated.save(path)
+        return updated
+
+    def select(self, rgt=None, cycle=None, start=None, end=None):
+        """
+        Granules of the given RGT(s) and cycle(s), acquired between
+        start and end (inclusive; an end date without time includes that day)
+        """
+        start = None if start is None else np.datetime64(pd.Timestamp(start), 'ns')
+        if end is not None:
+            end = pd.Timestamp(end)
+            if end == end.normalize():
+                end += pd.Timedelta(days=1) - pd.Timedelta(1, 'ns')
+            end = np.datetime64(end, 'ns')
+
+        if rgt is not None:
+            rgt = np.atleast_1d(rgt).astype(self._rgt.dtype)
+            lo = np.searchsorted(self._rgt, rgt, side='left')
+            hi = np.searchsorted(self._rgt, rgt, side='right')
+            idx = np.concatenate([np.arange(l, h) for l, h in zip(lo, hi)] +
+                                 [np.empty(0, dtype=np.intp)])
+        elif start is not None or end is not None:
+            lo = 0 if start is None else np.searchsorted(self._dates, start, side='left')
+            hi = len(self._dates) if end is None else np.searchsorted(self._dates, end, side='right')
+            idx = np.sort(self._by_date[lo:hi])
+        else:
+            idx = np.arange(len(self.df))
+
+        sub = self.df.iloc[idx]
+        mask = np.ones(len(sub), dtype=bool)
+        if cycle is not None:
+            mask &= np.isin(sub['cycle'].to_numpy(), np.atleast_1d(cycle))
+        if start is not None:
+            mask &= sub['date'].to_numpy() >= start
+        if end is not None:
+            mask &= sub['date'].to_numpy() <= end
+        return sub[mask]
+
+    def para_lists(self, bbox, **kwargs):
+        """API query parameters (see file_meta) of the selected granules"""
+        return file_meta(self.select(**kwargs)['name'], bbox)
+
+
+def plan_requests(para_lists, footprints=None, binsize=5, buffer=0.05):
+    """
+    Plan the OpenAltimetry requests of a set of tracks
+    Inputs:
+        para_lists: list of [trackId, Date, cycle, bbox] (see file_meta)
+        footprints: optional {rgt (int): shapely geometry in lon/lat} of the
+            ground tracks (e.g. from granule metadata)
+        binsize: max size (deg) of the bbox of one request
+        buffer: margin (deg) kept around a footprint, must be > 0 for
+            line footprints
+    Output:
+        para_lists with one entry per (track, tile) to request
+    Repeated (rgt, date) are requested once. Without a footprint, a track
+    is requested over every binsize tile of its bbox (as grid_bbox). With
+    one, the footprint is clipped to the bbox and only its bounds are
+    tiled, so tiles it does not cross are dropped and adjacent tiles are
+    merged whenever the binsize limit allows; each tile is then tightened
+    to the part of the footprint inside it.
+    """
+    from shapely.geometry import box
+
+    plan = []
+    seen = set()
+    for paralist in para_lists:
+        trackId, Date, cycle, bbox = paralist[0], paralist[1], paralist[2], paralist[3]
+        if (int(trackId), Date) in seen:
+            continue
+        seen.add((int(trackId), Date))
+
+        footprint = footprints.get(int(trackId)) if footprints else None
+
+        if footprint is None:
+            tiles = grid_bbox(bbox, binsize)
+        else:
+            track = footprint.buffer(buffer).intersection(box(*bbox))
+            tiles = []
+            if not track.is_empty:
+                for tile in grid_bbox(track.bounds, binsize):
+                    part = track.intersection(box(*tile))
+                    if not part.is_empty:
+                        tiles.append(list(part.bounds))
+
+        plan += [[trackId, Date, cycle, tile] for tile in tiles]
+
+    return plan
+
+
+def print_plan(plan, para_lists=None, beams=None, binsize=5):
+    """
+    Dry run: print the requests of a plan (see plan_requests), and the
+    number of requests it saves over querying every track on every tile
+    of para_lists (binsize: the tile size the plan was built with)
+    """
+    beams = beams or cn.beamlist
+    for trackId, Date, cycle, bbox in (p[:4] for p in plan):
+        print('rgt {:>4} {} cycle {:>2}  bbox [{:.3f}, {:.3f}, {:.3f}, {:.3f}]  x {} beams'.format(
+            trackId, Date, cycle, *bbox, len(beams)))
+
+    nreq = len(plan) * len(beams)
+    print('{} tracks, {} tiles, {} requests'.format(
+        len({(int(p[0]), p[1]) for p in plan}), len(plan), nreq))
+    if para_lists is not None:
+        naive = sum(len(grid_bbox(p[3], binsize)) for p in para_lists) * len(beams)
+        print('unplanned: {} requests ({:.0f}% saved)'.format(
+            naive, 100 * (1 - nreq / naive) if naive else 0))
+
+
+class RateLimiter:
+    """Allow at most `rate` calls per second, shared between threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            t = max(now, self.next_time)
+            self.next_time = t + self.interval
+        if t > now:
+            time.sleep(t - now)
+
+
+class OAClient:
+    """
+    Concurrent client for the OpenAltimetry API
+    Inputs:
+        base_url: API endpoint (default config.base_url)
+        max_workers: max number of requests in flight
+        rate: max requests per second per host (None for no limit)
+        timeout: request timeout (s)
+        retries: number of retries on connection errors, timeouts and 429/5xx
+        backoff: base delay (s) of the exponential backoff between retries
+        cache: ResponseCache (or True for the default one) to serve repeated
+            requests from disk
+    Requests share one pooled session. A request still failing after
+    its retries raises, unless a `failed` list is passed to the request
+    methods to collect the failures of that call instead.
+    """
+
+    def __init__(self, base_url=None, max_workers=8, rate=None, timeout=30,
+                 retries=3, backoff=0.5, cache=None):
+        self.base_url = base_url or cn.base_url
+        self.cache = ResponseCache() if cache is True else cache
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.rate = rate
+        self.limiters = {}
+        self.lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=max_workers,
+                                                pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _limiter(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.limiters:
+                self.limiters[host] = RateLimiter(self.rate)
+            return self.limiters[host]
+
+    def get(self, payload, url=None):
+        """GET one API request (with retries) and return the decoded json."""
+        url = url or self.base_url
+
+        if self.cache is not None:
+            key = request_key(url, payload)
+            content = self.cache.get(key)
+            if content is not None:
+                return json.loads(content)
+
+        for attempt in range(self.retries + 1):
+            self._limiter(url).wait()
+            try:
+                r = self.session.get(url, params=payload, timeout=self.timeout)
+                if r.status_code not in RETRY_STATUS:
+                    r.raise_for_status()
+                    data = r.json()
+                    if self.cache is not None:
+                        self.cache.put(key, r.content)
+                    return data
+                error = requests.HTTPError(f'{r.status_code} for {r.url}', response=r)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            if attempt < self.retries:
+                time.sleep(self.backoff * 2 ** attempt * (1 + random.random()))
+        raise error
+
+    def beam_request(self, paralist, beam, product='atl06'):
+        """Request data of one beam of one RGT (see OA_request)"""
+        trackId, Date, cycle, bbox = paralist[0], paralist[1], paralist[2], paralist[3]
+        payload = oa_payload(trackId, Date, bbox, beam, product)
+        return beam_frame(self.get(payload), beam, cycle, Date)
+
+    def iter_requests(self, para_lists, product='atl06', beams=None, failed=None):
+        """
+        Run the requests of all tracks and beams concurrently
+        Yields (paralist, beam, dataframe) as each request completes.
+        At most 2 * max_workers requests are submitted ahead of the
+        consumer, so results waiting to be consumed stay bounded.
+        The first failed request raises (pending ones are cancelled),
+        unless `failed` is a list: failures are then printed, appended
+        to it as (paralist, beam, error) and skipped.
+        """
+        beams = beams or cn.beamlist
+        todo = ((paralist, beam) for paralist in para_lists for beam in beams)
+        pending = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while True:
+                for paralist, beam in islice(todo, 2 * self.max_workers - len(pending)):
+                    future = pool.submit(self.beam_request, paralist, beam, product)
+                    pending[future] = (paralist, beam)
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    paralist, beam = pending.pop(future)
+                    try:
+                        df = future.result()
+                    except Exception as e:
+                        if failed is None:
+                            for f in pending:
+                                f.cancel()
+                            raise
+                        print('failed request:', paralist[0], paralist[1], beam, '-', e)
+                        failed.append((paralist, beam, e))
+                        continue
+                    yield paralist, beam, df
+
+    def request_all(self, para_lists, product='atl06', failed=None):
+        """Request all tracks and beams and return one dataframe"""
+        return concat_frames(df for _, _, df in self.iter_requests(para_lists, product,
+                                                                    failed=failed))
+
+    def iter_batches(self, para_lists, product='atl06', batch_size=1000000, failed=None):
+        """
+        Request all tracks and beams and yield dataframes of batch_size
+        points (the last one may be smaller) as requests complete
+        """
+        buf, npts = [], 0
+        for _, _, df in self.iter_requests(para_lists, product, failed=failed):
+            if not len(df):
+                continue
+            buf.append(df)
+            npts += len(df)
+            if npts >= batch_size:
+                # one concat per full buffer; only the remainder is copied again
+                df = concat_frames(buf)
+                nfull = npts - npts % batch_size
+                for i in range(0, nfull, batch_size):
+                    yield df.iloc[i:i + batch_size].reset_index(drop=True)
+                buf, npts = [df.iloc[nfull:]], npts - nfull
+        if npts:
+            yield concat_frames(buf)
+
+    def to_parquet(self, para_lists, path, product='atl06', batch_size=1000000,
+                   compression='zstd', failed=None):
+        """
+        Request all tracks and beams and write the points to one Parquet
+        file, batch by batch (one row group per batch), so memory use does
+        not grow with the size of the region. Returns the number of points.
+        Requires pyarrow.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        category = pa.dictionary(pa.int32(), pa.string())
+        schema = pa.schema([('lat', pa.float64()), ('lon', pa.float64()), ('h', pa.float64()),
+                            ('beam', category), ('cycle', category), ('time', category)])
+        npts = 0
+        with pq.ParquetWriter(path, schema, compression=compression) as writer:
+            for df in self.iter_batches(para_lists, product, batch_size, failed):
+                df = df.astype({col: str for col in CATEGORICAL})
+                writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+                npts += len(df)
+        return npts
+
+
+def oa_payload(trackId, Date, bbox, beam, product='atl06'):
+    """Generate the API query of one beam"""
+    return {'product':product,
+            'endDate': Date,
+            'minx':str(bbox[0]),
+            'miny':str(bbox[1]),
+            'maxx':str(bbox[2]),
+            'maxy':str(bbox[3]),
+            'trackId': trackId,
+            'beamName': beam,
+            'outputFormat':'json'}
+
+
+def beam_frame(elevation_data, beam, cycle, Date):
+    """
+    Extract the points of one beam from an API response
+    The lat_lon_elev array of the granule acquired on Date is decoded
+    into numpy columns; beam, cycle and time are categorical.
+    Output:
+        dataframe with lat, lon, h, beam, cycle, time (empty if no data)
+    """
+    # granule satifying aqusition time
+    beam_data = next((d for d in elevation_data['data'] if d['date'] == Date), None)
+
+    # elevation array
+    beam_elev = beam_data['beams'][0]['lat_lon_elev'] if beam_data else None
+
+    if not beam_elev: # check if no data
+        return pd.DataFrame()
+
+    elev = np.fromiter(chain.from_iterable(beam_elev), dtype=np.float64,
+                       count=3 * len(beam_elev)).reshape(-1, 3)
+    codes = np.zeros(len(elev), dtype=np.int8)
+
+    return pd.DataFrame({
+        'lat': elev[:, 0],
+        'lon': elev[:, 1],
+        'h': elev[:, 2],
+        'beam': pd.Categorical.from_codes(codes, [beam]),
+        'cycle': pd.Categorical.from_codes(codes, [cycle]),
+        'time': pd.Categorical.from_codes(codes, [Date]),
+    })
+
+
+def concat_frames(frames):
+    """Concatenate beam/track dataframes, keeping categorical columns categorical"""
+    frames = [df for df in frames if len(df)]
+    if not frames:
+        return pd.DataFrame()
+
+    df = pd.concat(frames, ignore_index=True)
+    for col in CATEGORICAL:
+        if col in df and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = union_categoricals([f[col] for f in frames])
+    return df
+
+
+_default_clients = {}
+
+
+def default_client(base_url=None):
+    """Shared OAClient (one per base_url) used by OA_request"""
+    base_url = base_url or cn.base_url
+    if base_url not in _default_clients:
+        _default_clients[base_url] = OAClient(base_url)
+    return _default_clients[base_url]
+
+
+def OA_request(paralist, product = 'atl06', client=None, base_url=None):
     """
     Request data from OpenAltimetry based on API
     Inputs:
@@ -80,58 +549,16 @@ def OA_request(paralist, product = 'atl06'):
             cycle: cycle number
             bbox: DEM bounding box
         product: ICESat-2 product
+        client: OAClient to use (default: a shared pooled client)
+        base_url: API endpoint of the default client (default config.base_url)
     Output:
         track_df: dataframe for all beams of one RGT
+    Raises the error of a request that still fails after its retries.
     """
-    points = [] # store all beam data for one RGT
-    trackId,Date,cycle,bbox = paralist[0], paralist[1], paralist[2], paralist[3]
-    # iterate all six beams 
-    for beam in cn.beamlist:
-        # Generate API
-        payload =  {'product':product,
-                    'endDate': Date,
-                    'minx':str(bbox[0]),
-                    'miny':str(bbox[1]),
-                    'maxx':str(bbox[2]),
-                    'maxy':str(bbox[3]),
-                    'trackId': trackId,
-                    'beamName': beam,
-                    'outputFormat':'json'}
-        
-        # request OpenAltimetry
-        r = requests.get(cn.base_url, params=payload)
-        
-        # get elevation data
-        elevation_data = r.json()
-        
-        # length of file list
-        file_len = len(elevation_data['data'])
-        
-        # file index satifies aqusition time from data file
-        idx = [elevation_data['data'][i]['date'] == Date for i in np.arange(file_len)]
-        
-        # get data we need
-        beam_data = list(compress(elevation_data['data'], idx)) 
-        
-        if not beam_data:
-            continue
-        
-        # elevation array
-        beam_elev = beam_data[0]['beams'][0]['lat_lon_elev']
-
-        if not beam_elev: # check if no data 
-            continue # continue to next beam  
-
-        for p in beam_elev:
-            points.append({
-                'lat': p[0],
-                'lon': p[1],
-                'h': p[2],
-                'beam': beam,
-                'cycle': cycle,
-                'time' : Date}
-            )
-    
-    track_df = pd.DataFrame.from_dict(points)
+    client = client or default_client(base_url)
+
+    # request all six beams concurrently
+    frames = {beam: df for _, beam, df in client.iter_requests([paralist], product)}
+    track_df = concat_frames(frames[beam] for beam in cn.beamlist if beam in frames)
     
-    return track_df
\ No newline at end of file
+    return track_df
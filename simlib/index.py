@@ -0,0 +1,177 @@
+"""
+Spatio-temporal index over reduced ATL06 files.
+
+Points are bucketed in fixed grid cells of the projection they were
+reduced to (x/y, e.g. the DEM's EPSG). Since points are stored in
+along-track order, each file contributes a few contiguous row ranges
+per cell. The index (an SQLite file) stores, for every range, the
+cell, cycle and time span, so a bbox/time query only reads the matching
+rows of the matching files.
+"""
+import sqlite3
+from pathlib import Path
+
+import h5py
+import numpy as np
+import pandas as pd
+
+from simlib.atl06lib import read_variable, h5_variables
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY, path TEXT UNIQUE, size INTEGER, mtime REAL);
+CREATE TABLE IF NOT EXISTS entries (
+    file_id INTEGER, cell_x INTEGER, cell_y INTEGER, cycle INTEGER,
+    t_min REAL, t_max REAL, row_start INTEGER, row_stop INTEGER);
+CREATE INDEX IF NOT EXISTS entries_cell ON entries (cell_x, cell_y);
+CREATE INDEX IF NOT EXISTS entries_file ON entries (file_id);
+"""
+
+
+def cell_runs(x, y, cell_size):
+    """Split along-track points into runs of consecutive points in one cell.
+
+    Returns (cell_x, cell_y, starts, stops) arrays, one entry per run.
+    """
+    cx = np.floor(x / cell_size).astype(np.int64)
+    cy = np.floor(y / cell_size).astype(np.int64)
+    change, = np.where((cx[1:] != cx[:-1]) | (cy[1:] != cy[:-1]))
+    starts = np.r_[0, change + 1]
+    stops = np.r_[starts[1:], len(x)]
+    return cx[starts], cy[starts], starts, stops
+
+
+class PointIndex:
+    """Persistent index of reduced ATL06 files by grid cell and time.
+
+    path: SQLite file holding the index
+    cell_size: grid cell size (m), fixed when the index is created
+    """
+
+    def __init__(self, path, cell_size=5000.0):
+        self.path = Path(path)
+        self.db = sqlite3.connect(str(self.path))
+        self.db.executescript(SCHEMA)
+
+        meta = dict(self.db.execute('SELECT key, value FROM meta'))
+        if 'cell_size' not in meta:
+            self.db.execute("INSERT INTO meta VALUES ('cell_size', ?)", (repr(float(cell_size)),))
+            self.db.commit()
+            meta['cell_size'] = repr(float(cell_size))
+        self.cell_size = float(meta['cell_size'])
+        self.epsg = meta.get('epsg')
+
+    def close(self):
+        self.db.close()
+
+    def add_files(self, files):
+        """Index reduced files (e.g. outdir.glob('*.h5')).
+
+        Files already indexed with the same size and mtime are skipped;
+        changed files are re-indexed. Returns the number of files added.
+        """
+        nadded = 0
+        for fname in files:
+            fname = Path(fname)
+            st = fname.stat()
+            row = self.db.execute('SELECT id, size, mtime FROM files WHERE path = ?',
+                                  (str(fname),)).fetchone()
+            if row and row[1] == st.st_size and row[2] == st.st_mtime:
+                continue
+            if row:
+                self.db.execute('DELETE FROM entries WHERE file_id = ?', (row[0],))
+                self.db.execute('DELETE FROM files WHERE id = ?', (row[0],))
+
+            with h5py.File(fname, 'r') as f:
+                x, y = f['x'][()], f['y'][()]
+                t_year = read_variable(f, 't_year')
+                cycle = int(f.attrs.get('cycle', -1))
+                epsg = f.attrs.get('epsg')
+
+            if epsg is not None:
+                epsg = str(epsg)
+                if self.epsg is None:
+                    self.db.execute("INSERT INTO meta VALUES ('epsg', ?)", (epsg,))
+                    self.epsg = epsg
+                elif epsg != self.epsg:
+                    raise ValueError(f'{fname} is in EPSG:{epsg}, index is in EPSG:{self.epsg}')
+
+            file_id = self.db.execute('INSERT INTO files (path, size, mtime) VALUES (?, ?, ?)',
+                                      (str(fname), st.st_size, st.st_mtime)).lastrowid
+
+            if len(x):
+                cx, cy, starts, stops = cell_runs(x, y, self.cell_size)
+                t_min = np.minimum.reduceat(t_year, starts)
+                t_max = np.maximum.reduceat(t_year, starts)
+                self.db.executemany(
+                    'INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    zip([file_id] * len(starts), cx.tolist(), cy.tolist(), [cycle] * len(starts),
+                        t_min.tolist(), t_max.tolist(), starts.tolist(), stops.tolist()))
+            nadded += 1
+
+        self.db.commit()
+        return nadded
+
+    def query(self, bbox, t_range=None, cycles=None):
+        """Find the row ranges that may hold points in bbox and time.
+
+        bbox: [xmin, ymin, xmax, ymax] in the index projection (e.g. DEM.bbox)
+        t_range: (tmin, tmax) in decimal years
+        cycles: list of cycle numbers
+
+        Returns a dict {file path: [(row_start, row_stop), ...]} with
+        adjacent ranges merged.
+        """
+        xmin, ymin, xmax, ymax = bbox
+        c = self.cell_size
+        sql = ('SELECT files.path, row_start, row_stop FROM entries '
+               'JOIN files ON files.id = entries.file_id '
+               'WHERE cell_x BETWEEN ? AND ? AND cell_y BETWEEN ? AND ?')
+        args = [int(np.floor(xmin / c)), int(np.floor(xmax / c)),
+                int(np.floor(ymin / c)), int(np.floor(ymax / c))]
+        if t_range is not None:
+            sql += ' AND t_max >= ? AND t_min <= ?'
+            args += [float(t_range[0]), float(t_range[1])]
+        if cycles is not None:
+            cycles = [int(k) for k in np.atleast_1d(cycles)]
+            sql += ' AND cycle IN ({})'.format(','.join('?' * len(cycles)))
+            args += cycles
+        sql += ' ORDER BY files.path, row_start'
+
+        ranges = {}
+        for path, start, stop in self.db.execute(sql, args):
+            runs = ranges.setdefault(path, [])
+            if runs and runs[-1][1] == start:
+                runs[-1] = (runs[-1][0], stop)
+            else:
+                runs.append((start, stop))
+        return ranges
+
+    def read(self, bbox, t_range=None, cycles=None, vnames=None):
+        """Read the points in bbox (and time) into a DataFrame.
+
+        Only the indexed row ranges are read from each file; points are
+        then masked exactly by bbox and t_range. `vnames` selects the
+        variables (default all, incl. derived ones).
+        """
+        xmin, ymin, xmax, ymax = bbox
+        frames = []
+
+        for path, runs in self.query(bbox, t_range, cycles).items():
+            with h5py.File(path, 'r') as f:
+                names = list(dict.fromkeys(list(vnames or h5_variables(f)) + ['x', 'y', 't_year']))
+                for start, stop in runs:
+                    sl = slice(start, stop)
+                    frames.append(pd.DataFrame({k: read_variable(f, k, sl) for k in names}))
+
+        if not frames:
+            return pd.DataFrame(columns=vnames)
+
+        df = pd.concat(frames, ignore_index=True)
+        mask = df['x'].between(xmin, xmax) & df['y'].between(ymin, ymax)
+        if t_range is not None:
+            mask &= df['t_year'].between(*t_range)
+        df = df[mask].reset_index(drop=True)
+
+        return df[vnames] if vnames else df
@@ -0,0 +1,301 @@
+"""
+Parallel ingestion of ATL06 granules.
+
+Runs read_atl06 over a directory of granules on a process pool. The
+number of granules in flight is bounded by an estimate of their memory
+footprint, so large runs saturate the cores without exhausting memory.
+A manifest in the output directory records what each granule produced,
+so reruns only process new or changed granules.
+
+ingest_urls instead downloads granules straight into memory and reduces
+them as they arrive, overlapping network and CPU.
+"""
+import os
+import json
+import time
+import queue
+import threading
+import traceback
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+
+from simlib.atl06lib import read_atl06
+from simlib.store import write_granule
+from simlib.download import file_checksum, download_buffer, EarthdataSession
+
+# Reader arguments that change how a granule is read, not what is written:
+# left out of the manifest, so changing them does not trigger a rerun
+RUN_ONLY_ARGS = ('nthreads', 'pushdown', 'lat_stride', 'strict', 'verbose', 'stats')
+
+# Outcome of one granule: status is 'ok', 'empty' (no points left),
+# 'failed' or 'skipped' (unchanged since the last run, see Manifest);
+# stats holds the points removed by each filter stage (see apply_filters)
+GranuleStatus = namedtuple(
+    'GranuleStatus', ['granule', 'status', 'seconds', 'npoints', 'outfiles', 'error', 'stats'],
+    defaults=(None,)
+)
+
+
+class Manifest:
+    """Persistent record of ingested granules.
+
+    Stored as JSON, keyed by granule file name. Each entry holds the
+    granule size and mtime (and MD5 checksum if `checksum`), the reader
+    parameters and the outputs produced. A granule is up to date if all
+    of these still match and its outputs exist.
+    """
+
+    def __init__(self, path, checksum=False):
+        self.path = Path(path)
+        self.checksum = checksum
+        self.entries = {}
+        if self.path.exists():
+            with open(self.path) as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def params(epsg, bbox, kwargs):
+        """Reader parameters affecting the outputs, in a JSON-comparable form."""
+        kwargs = {k: v for k, v in kwargs.items() if k not in RUN_ONLY_ARGS}
+        params = dict(kwargs, epsg=str(epsg), bbox=None if bbox is None else [float(b) for b in bbox])
+        if params.get('filters') is not None:
+            # the repr of a Filter holds its parameters, not function addresses
+            params['filters'] = [repr(f) for f in params['filters']]
+        return json.loads(json.dumps(params, sort_keys=True, default=str))
+
+    def _stat(self, fname):
+        st = Path(fname).stat()
+        stat = {'size': st.st_size, 'mtime': st.st_mtime}
+        if self.checksum:
+            stat['md5'] = file_checksum(fname)
+        return stat
+
+    def is_current(self, fname, params):
+        """True if granule is unchanged and was ingested with `params`."""
+        entry = self.entries.get(Path(fname).name)
+        if entry is None or entry['params'] != params:
+            return False
+        if entry['stat'] != self._stat(fname):
+            return False
+        return all(Path(f).exists() for f in entry['outfiles'])
+
+    def update(self, fname, params, outfiles):
+        self.entries[Path(fname).name] = {
+            'stat': self._stat(fname),
+            'params': params,
+            'outfiles': outfiles,
+        }
+
+    def save(self):
+        """Write the manifest (atomically replacing the old one)."""
+        tmp = self.path.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.path)
+
+
+def _ingest_granule(fname, epsg, outdir, bbox, kwargs):
+    """Worker: reduce one granule and report its status (and filter stats)."""
+    t0 = time.perf_counter()
+    kwargs = dict(kwargs)
+    writer = write_granule if kwargs.pop('format', 'h5') == 'parquet' else read_atl06
+    stats = {}
+    try:
+        outfiles = writer(fname, epsg, outdir, bbox, strict=True, verbose=False,
+                          stats=stats, **kwargs)
+    except Exception:
+        return GranuleStatus(str(fname), 'failed', time.perf_counter() - t0, 0, {},
+                             traceback.format_exc())
+
+    npoints = sum(outfiles.values())
+    status = 'ok' if npoints else 'empty'
+    return GranuleStatus(str(fname), status, time.perf_counter() - t0, npoints,
+                         outfiles, None, stats)
+
+
+def add_stats(stats, r):
+    """Add the filter stats of a GranuleStatus to the `stats` dict."""
+    if stats is not None and r.stats:
+        for k, v in r.stats.items():
+            stats[k] = stats.get(k, 0) + v
+
+
+def summarize(results):
+    """Count granules per status, total points and summed wall time (s)."""
+    summary = {'ok': 0, 'empty': 0, 'failed': 0, 'skipped': 0}
+    for r in results:
+        summary[r.status] += 1
+    summary['npoints'] = sum(r.npoints for r in results)
+    summary['seconds'] = sum(r.seconds for r in results)
+    return summary
+
+
+def ingest_granules(granule_dir, bbox, epsg, outdir='data', pattern='ATL06_*.h5',
+                    nprocs=None, mem_budget=4e9, mem_factor=3.0, manifest=True,
+                    checksum=False, verbose=True, **kwargs):
+    """Reduce all ATL06 granules in a directory on a process pool.
+
+    Each granule is estimated to need `mem_factor` times its file size in
+    memory; new granules are only submitted while the estimates of those
+    in flight fit in `mem_budget` (bytes). One granule is always allowed,
+    however large. Extra keyword arguments are passed to read_atl06;
+    with format='parquet' the granules go to the columnar store in
+    `outdir` instead (see store.write_granule). A `stats` dict is
+    updated with the filter stats of all granules (see apply_filters).
+
+    With `manifest`, granules already ingested with the same parameters
+    (and unchanged size/mtime, or MD5 if `checksum`) are skipped, using
+    the manifest file 'manifest.json' in `outdir`.
+
+    Returns a list of GranuleStatus, one per granule, in completion order.
+    """
+    files = sorted(Path(granule_dir).glob(pattern))
+    nprocs = nprocs or os.cpu_count()
+    stats = kwargs.pop('stats', None)
+
+    Path(outdir).mkdir(parents=True, exist_ok=True)
+
+    results = []
+    pending = {}  # future -> (granule, estimated memory)
+    todo = list(reversed(files))
+
+    if manifest:
+        manifest = Manifest(Path(outdir) / 'manifest.json', checksum)
+        params = Manifest.params(epsg, bbox, kwargs)
+        for fname in files:
+            if manifest.is_current(fname, params):
+                outfiles = manifest.entries[fname.name]['outfiles']
+                results.append(GranuleStatus(str(fname), 'skipped', 0.0,
+                                             sum(outfiles.values()), outfiles, None))
+        skip = {r.granule for r in results}
+        todo = [f for f in todo if str(f) not in skip]
+
+    try:
+        with ProcessPoolExecutor(max_workers=nprocs) as pool:
+            while todo or pending:
+
+                # Submit while the in-flight estimate fits in the budget
+                while todo and len(pending) < 2 * nprocs:
+                    need = mem_factor * todo[-1].stat().st_size
+                    if pending and sum(n for _, n in pending.values()) + need > mem_budget:
+                        break
+                    fname = todo.pop()
+                    future = pool.submit(_ingest_granule, fname, epsg, outdir, bbox, kwargs)
+                    pending[future] = (fname, need)
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    fname, _ = pending.pop(future)
+                    try:
+                        r = future.result()
+                    except Exception:
+                        # e.g. arguments that cannot be sent to the worker
+                        r = GranuleStatus(str(fname), 'failed', 0.0, 0, {},
+                                          traceback.format_exc())
+                    results.append(r)
+                    add_stats(stats, r)
+                    if verbose and r.status == 'failed':
+                        print('failed:', r.granule, '-', r.error.strip().splitlines()[-1])
+                    if manifest and r.status != 'failed':
+                        manifest.update(r.granule, params, r.outfiles)
+    finally:
+        if manifest:
+            manifest.save()
+
+    if verbose:
+        s = summarize(results)
+        print('ingested {} granules ({} ok, {} empty, {} failed, {} skipped): '
+              '{} points, {:.1f} s wall time summed over granules'.format(
+                  len(results), s['ok'], s['empty'], s['failed'], s['skipped'],
+                  s['npoints'], s['seconds']))
+
+    return results
+
+
+def ingest_urls(urls, bbox, epsg, outdir='data', keep_raw=None, ndownloads=4,
+                queue_size=4, session=None, verbose=True, **kwargs):
+    """Download ATL06 granules and reduce them as they arrive.
+
+    Granules are downloaded into memory (see download.download_buffer) on
+    `ndownloads` threads and passed through a queue of at most
+    `queue_size` granules to the reduction, which runs in the calling
+    thread and opens each buffer directly with h5py. Downloads and
+    processing overlap, and at most queue_size + ndownloads granules are
+    held in memory. The raw granules only hit disk if `keep_raw` (a
+    directory) is given. Extra keyword arguments are passed to read_atl06
+    (or store.write_granule with format='parquet'); a `stats` dict is
+    updated with the filter stats of all granules.
+
+    Returns a list of GranuleStatus (granule is the URL), in completion order.
+    """
+    session = session or EarthdataSession(pool_size=ndownloads)
+    stats = kwargs.pop('stats', None)
+    Path(outdir).mkdir(parents=True, exist_ok=True)
+    if keep_raw:
+        Path(keep_raw).mkdir(parents=True, exist_ok=True)
+
+    granules = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def put(item):
+        # block while the queue is full, unless the consumer has stopped
+        while not stop.is_set():
+            try:
+                granules.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    def fetch(url):
+        if stop.is_set():
+            return
+        t0 = time.perf_counter()
+        try:
+            buf = download_buffer(session, url)
+            if keep_raw:
+                raw = Path(keep_raw) / buf.name
+                tmp = raw.with_name(raw.name + '.part')
+                tmp.write_bytes(buf.getvalue())
+                os.replace(tmp, raw)
+        except Exception:
+            put((url, None, time.perf_counter() - t0, traceback.format_exc()))
+            return
+        put((url, buf, time.perf_counter() - t0, None))
+
+    def download_all():
+        with ThreadPoolExecutor(max_workers=ndownloads) as pool:
+            list(pool.map(fetch, urls))
+        put(None)
+
+    producer = threading.Thread(target=download_all, daemon=True)
+    producer.start()
+
+    results = []
+    try:
+        while True:
+            item = granules.get()
+            if item is None:
+                break
+            url, buf, seconds, error = item
+            if buf is None:
+                r = GranuleStatus(url, 'failed', seconds, 0, {}, error)
+            else:
+                r = _ingest_granule(buf, epsg, outdir, bbox, kwargs)._replace(granule=url)
+                buf.close()
+            results.append(r)
+            add_stats(stats, r)
+            if verbose and r.status == 'failed':
+                print('failed:', r.granule, '-', r.error.strip().splitlines()[-1])
+    finally:
+        stop.set()
+        producer.join()
+
+    if verbose:
+        s = summarize(results)
+        print('ingested {} granules ({} ok, {} empty, {} failed): '
+              '{} points, {:.1f} s wall time summed over granules'.format(
+                  len(results), s['ok'], s['empty'], s['failed'], s['npoints'], s['seconds']))
+
+    return results
@@ -0,0 +1,180 @@
+"""
+Local stand-in for the OpenAltimetry level3a API.
+
+Serves the JSON shape read by icesatapi.OA_request,
+
+    {'data': [{'date': 'yyyy-mm-dd',
+               'beams': [{'beam_name': 'gt1l', 'lat_lon_elev': [[lat, lon, h], ...]}]},
+              ...]}
+
+with synthetic tracks: `npoints` points per beam running south to north
+across the requested bbox, plus a granule of the day before (so date
+filtering is exercised). Responses are deterministic for a given query
+and cached, so the server is not the bottleneck of repeated benchmarks.
+Latency, error rate and payload size are tunable, so clients can be
+tested and benchmarked offline.
+
+Run standalone with `python -m simlib.oaserver --port 8000`.
+"""
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from functools import lru_cache
+from datetime import date, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+
+def synthetic_track(trackId, Date, beam, bbox, npoints):
+    """lat_lon_elev array of one synthetic beam crossing bbox"""
+    seed = hashlib.sha1(f'{trackId}/{Date}/{beam}'.encode()).digest()
+    rng = np.random.default_rng(int.from_bytes(seed[:8], 'little'))
+
+    lonmin, latmin, lonmax, latmax = bbox
+    frac = np.linspace(0, 1, npoints)
+    lat = latmin + (latmax - latmin) * frac
+    lon = lonmin + (lonmax - lonmin) * (rng.uniform(0.1, 0.85) + 0.05 * frac)
+    h = 4000 + 500 * np.sin(lat * 50) + rng.normal(0, 1, npoints)
+
+    return np.column_stack([lat.round(6), lon.round(6), h.round(3)])
+
+
+@lru_cache(maxsize=4096)
+def response_body(query, npoints):
+    """JSON response of one API query (sorted (key, value) pairs)"""
+    q = dict(query)
+    Date = q['endDate']
+    bbox = [float(q[k]) for k in ('minx', 'miny', 'maxx', 'maxy')]
+    before = (date.fromisoformat(Date) - timedelta(days=1)).isoformat()
+
+    return json.dumps({'data': [
+        {'date': d,
+         'beams': [{'beam_name': q['beamName'],
+                    'lat_lon_elev': synthetic_track(q['trackId'], d, q['beamName'],
+                                                    bbox, npoints).tolist()}]}
+        for d in (before, Date)]}).encode()
+
+
+class OAServer:
+    """
+    Threaded HTTP server mimicking the OpenAltimetry API
+    Inputs:
+        host, port: address to listen on (port 0 picks a free port)
+        latency: mean response delay (s)
+        jitter: response delays are uniform in latency +/- jitter
+        error_rate: fraction of requests answered with HTTP 503
+        npoints: number of points per beam
+        seed: seed of the latency/error draws
+    Use as a context manager, or call start() and stop().
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0,
+                 npoints=1000, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.npoints = npoints
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.nrequests = 0
+        self.nerrors = 0
+        self.thread = None
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep-alive, so pooled clients reuse their connections
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.handle(self)
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+            request_queue_size = 128
+
+        self.httpd = Server((host, port), Handler)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/data/api/icesat2/level3a'
+
+    def handle(self, request):
+        with self.lock:
+            self.nrequests += 1
+            delay = max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+            error = self.rng.random() < self.error_rate
+            if error:
+                self.nerrors += 1
+
+        time.sleep(delay)
+
+        if error:
+            request.send_response(503)
+            request.send_header('Content-Length', '0')
+            request.end_headers()
+            return
+
+        try:
+            query = {k: v[0] for k, v in parse_qs(urlparse(request.path).query).items()}
+            body = response_body(tuple(sorted(query.items())), self.npoints)
+        except (KeyError, ValueError) as e:
+            request.send_error(400, str(e))
+            return
+
+        request.send_response(200)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local stand-in for the OpenAltimetry API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0, help='mean delay (s)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='delay jitter (s)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of 503 responses')
+    parser.add_argument('--npoints', type=int, default=1000, help='points per beam')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    server = OAServer(args.host, args.port, args.latency, args.jitter, args.error_rate,
+                      args.npoints, args.seed)
+    print(server.url, flush=True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
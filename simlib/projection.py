@@ -0,0 +1,78 @@
+"""
+Coordinate transformations shared across simlib.
+
+Building a pyproj Transformer is expensive, so they are cached by
+(src, dst) EPSG pair. A Transformer must not be used from several
+threads at once, so each thread keeps its own cache. Threaded transforms
+run on persistent pools, so their threads' caches are reused across calls.
+
+Coordinates are always in x/y order (lon/lat for geographic CRSs).
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pyproj
+
+_local = threading.local()
+
+_pools = {}  # nthreads -> ThreadPoolExecutor
+_pools_lock = threading.Lock()
+
+
+def get_transformer(proj1, proj2):
+    """Return the (cached) Transformer from proj1 to proj2 (EPSG num)."""
+    cache = getattr(_local, 'cache', None)
+    if cache is None:
+        cache = _local.cache = {}
+
+    key = (int(proj1), int(proj2))
+
+    if key not in cache:
+        cache[key] = pyproj.Transformer.from_crs(
+            'EPSG:' + str(key[0]), 'EPSG:' + str(key[1]), always_xy=True
+        )
+    return cache[key]
+
+
+def get_pool(nthreads):
+    """Return the persistent thread pool of size nthreads."""
+    with _pools_lock:
+        if nthreads not in _pools:
+            _pools[nthreads] = ThreadPoolExecutor(max_workers=nthreads,
+                                                  thread_name_prefix='projection')
+        return _pools[nthreads]
+
+
+def transform_coord(proj1, proj2, x, y, chunk_size=1000000, nthreads=1):
+    """Transform coordinates from proj1 to proj2 (EPSG num).
+
+    Large arrays are transformed in chunks of `chunk_size` points,
+    optionally on `nthreads` threads (pyproj releases the GIL).
+
+    Example EPSG projections:
+        Geodetic (lon/lat): 4326
+        Polar Stereo AnIS (x/y): 3031
+        Polar Stereo GrIS (x/y): 3413
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    if x.size <= chunk_size:
+        return get_transformer(proj1, proj2).transform(x, y)
+
+    shape = x.shape
+    x, y = x.ravel(), y.ravel()
+    xo, yo = np.empty_like(x), np.empty_like(y)
+
+    def transform(sl):
+        xo[sl], yo[sl] = get_transformer(proj1, proj2).transform(x[sl], y[sl])
+
+    chunks = [slice(i, i + chunk_size) for i in range(0, x.size, chunk_size)]
+
+    if nthreads > 1:
+        list(get_pool(nthreads).map(transform, chunks))
+    else:
+        for sl in chunks:
+            transform(sl)
+
+    return xo.reshape(shape), yo.reshape(shape)
@@ -0,0 +1,112 @@
+"""
+Columnar (Parquet) store for processed ATL06 points.
+
+Reduced beams are written to a hive-partitioned dataset,
+
+    root/rgt=<rgt>/cycle=<cycle>/beam=<beam>/<granule>.parquet
+
+with typed columns and row-group statistics. Points are stored in
+along-track order, so lat/lon/x/y/time ranges of each row group are
+tight and region/time queries skip whole files (by partition) and row
+groups (by statistics) without reading them.
+
+Requires pyarrow.
+"""
+from pathlib import Path
+
+import numpy as np
+
+from simlib.atl06lib import iter_atl06
+
+# Partition columns, in directory order
+PARTITIONS = ['rgt', 'cycle', 'beam']
+
+
+def write_granule(fname, epsg, root, bbox=None, row_group_size=20000,
+                  compression='zstd', **kwargs):
+    """Reduce one ATL06 granule into the store under `root`.
+
+    Extra keyword arguments are passed to iter_atl06. Returns a dict
+    {output file: number of points}, like read_atl06.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    outfiles = {}
+    kwargs.setdefault('verbose', False)
+
+    for beam, data, attrs in iter_atl06(fname, epsg, bbox, **kwargs):
+
+        table = pa.table(data).replace_schema_metadata({
+            'epsg': str(epsg),
+            't_ref': repr(attrs['t_ref']),
+            'beam_type': attrs['beam_type'],
+            'spot_number': attrs['spot_number'],
+        })
+
+        outdir = Path(root) / f"rgt={attrs['rgt']}" / f"cycle={attrs['cycle']}" / f'beam={beam}'
+        outdir.mkdir(parents=True, exist_ok=True)
+        outfile = outdir / Path(getattr(fname, 'name', fname)).name.replace('.h5', '.parquet')
+
+        pq.write_table(table, outfile, row_group_size=row_group_size,
+                       compression=compression, write_statistics=True)
+
+        outfiles[str(outfile)] = table.num_rows
+
+    return outfiles
+
+
+def _between(field, vmin, vmax):
+    import pyarrow.dataset as ds
+    return (ds.field(field) >= vmin) & (ds.field(field) <= vmax)
+
+
+def read_store(root, bbox=None, bbox_xy=None, t_range=None, rgt=None, cycle=None,
+               beam=None, columns=None, geo=False):
+    """Query the store and return a (Geo)DataFrame.
+
+    bbox: [lonmin, latmin, lonmax, latmax]
+    bbox_xy: [xmin, ymin, xmax, ymax] in the store projection
+    t_range: (tmin, tmax) in decimal years
+    rgt, cycle, beam: single value or list (pruned by partition)
+
+    If `geo`, return a GeoDataFrame of x/y points in the store projection.
+    """
+    import pyarrow.dataset as ds
+
+    files = sorted(str(f) for f in Path(root).rglob('*.parquet'))
+    dataset = ds.dataset(files, format='parquet', partitioning='hive',
+                         partition_base_dir=str(root))
+
+    filters = []
+    if bbox is not None:
+        filters += [_between('lon', bbox[0], bbox[2]), _between('lat', bbox[1], bbox[3])]
+    if bbox_xy is not None:
+        filters += [_between('x', bbox_xy[0], bbox_xy[2]), _between('y', bbox_xy[1], bbox_xy[3])]
+    if t_range is not None:
+        filters.append(_between('t_year', *t_range))
+    for name, value in zip(PARTITIONS, [rgt, cycle, beam]):
+        if value is not None:
+            filters.append(ds.field(name).isin(np.atleast_1d(value).tolist()))
+
+    expr = None
+    for f in filters:
+        expr = f if expr is None else expr & f
+
+    if columns is not None and geo:
+        columns = list(dict.fromkeys(list(columns) + ['x', 'y']))
+
+    df = dataset.to_table(columns=columns, filter=expr).to_pandas(split_blocks=True)
+
+    if not geo:
+        return df
+
+    import geopandas as gpd
+
+    epsg = None
+    if dataset.files:
+        import pyarrow.parquet as pq
+        epsg = pq.read_schema(dataset.files[0]).metadata.get(b'epsg', b'').decode() or None
+
+    return gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df['x'], df['y']),
+                            crs='EPSG:' + epsg if epsg else None)
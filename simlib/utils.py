@@ -4,7 +4,6 @@ High-level functions used across the CAP-Toolkit package.
 """
 import h5py
 import numpy as np
-import pyproj
 import xarray as xr
 import pandas as pd
 from scipy.spatial import cKDTree
@@ -14,6 +13,7 @@ from scipy.ndimage import map_coordinates
 from gdalconst import *
 from osgeo import gdal, osr
 from scipy import signal
+from simlib import projection
 
 def print_args(args):
     """Print arguments passed to argparse."""
@@ -124,10 +124,7 @@ def transform_coord(proj1, proj2, x, y):
     :return: x and y now in proj2
     """
 
-    proj1 = pyproj.Proj("+init=EPSG:" + str(proj1))
-    proj2 = pyproj.Proj("+init=EPSG:" + str(proj2))
-
-    return pyproj.transform(proj1, proj2, x, y)
+    return projection.transform_coord(proj1, proj2, x, y)
 
 
 def mad_std(x, axis=None):
@@ -0,0 +1,75 @@
+import h5py
+import numpy as np
+
+from simlib.atl06lib import read_atl06, read_h5, iter_atl06, default_filters, snr_filter
+
+T_REF = 1198800018.0
+
+
+def make_granule(fname, n=1000, seed=0):
+    """Write a small synthetic ATL06 granule (one strong beam)"""
+    rng = np.random.default_rng(seed)
+    lat = np.linspace(40.0, 41.0, n)
+    variables = {
+        'latitude': lat,
+        'longitude': -122.0 + 0.1 * (lat - 40.0),
+        'h_li': 1000 + 10 * np.sin(lat * 20),
+        'h_li_sigma': rng.random(n),
+        'delta_time': 5e7 + np.linspace(0, 100, n),
+        'atl06_quality_summary': np.zeros(n, dtype='i1'),
+        'fit_statistics/signal_selection_source': np.zeros(n, dtype='i1'),
+        'fit_statistics/snr_significance': np.full(n, 0.001),
+        'fit_statistics/h_robust_sprd': rng.random(n),
+        'fit_statistics/dh_fit_dx': rng.normal(0, 0.01, n),
+        'geophysical/dac': rng.random(n),
+        'geophysical/bsnow_conf': np.zeros(n, dtype='i1'),
+        'geophysical/tide_earth': rng.random(n),
+        'geophysical/tide_load': rng.random(n),
+        'geophysical/tide_ocean': rng.random(n),
+        'geophysical/tide_pole': rng.random(n),
+    }
+    with h5py.File(fname, 'w') as f:
+        f['/orbit_info/rgt'] = np.array([1234], 'i2')
+        f['/orbit_info/cycle_number'] = np.array([5], 'i1')
+        f['/ancillary_data/atlas_sdp_gps_epoch'] = np.array([T_REF])
+        beam = f.create_group('gt1l')
+        beam.attrs['atlas_beam_type'] = np.bytes_(b'strong')
+        beam.attrs['atlas_spot_number'] = np.bytes_(b'1')
+        segments = beam.create_group('land_ice_segments')
+        for name, values in variables.items():
+            segments[name] = values
+    return variables
+
+
+def test_read_atl06_columns_without_derived(tmp_path):
+    fname = tmp_path / 'ATL06_20190101000000_12340503_003_01.h5'
+    variables = make_granule(fname)
+
+    outfiles = read_atl06(fname, 3031, outdir=tmp_path / 'out', columns=['h_li'],
+                          store_derived=False, filters=[], verbose=False)
+
+    assert len(outfiles) == 1
+    outfile, npts = next(iter(outfiles.items()))
+    assert npts == len(variables['h_li'])
+    with h5py.File(outfile, 'r') as f:
+        assert {'h_li', 't_dt', 'x', 'y'} <= set(f.keys())
+        assert 't_gps' not in f and 't_year' not in f
+        np.testing.assert_array_equal(f['t_dt'][:], variables['delta_time'])
+
+    data, vnames = read_h5(outfile, ['t_gps', 't_year'])
+    np.testing.assert_allclose(data[:, 0], T_REF + variables['delta_time'])
+    assert np.all((data[:, 1] > 2019.0) & (data[:, 1] < 2020.0))
+
+
+def test_iter_atl06_custom_filters_keep_bbox(tmp_path):
+    fname = tmp_path / 'ATL06_20190101000000_12340503_003_01.h5'
+    make_granule(fname)
+    bbox = [-121.97, 40.0, -121.93, 41.0]
+
+    beams = list(iter_atl06(fname, 3031, bbox, filters=default_filters() + [snr_filter()],
+                            verbose=False))
+
+    assert len(beams) == 1
+    lon = beams[0][1]['lon']
+    assert len(lon) > 0
+    assert lon.min() >= bbox[0] and lon.max() <= bbox[2]